@@ -1,11 +1,11 @@
-from openai import OpenAI
-from typing import Optional, Callable, Any, List
+from typing import Optional, Callable, Any, List, AsyncIterator, Tuple
 from collections import deque
-from dotenv import load_dotenv
 from dataclasses import dataclass
+from model_router import ModelRouter, OpenAIBackend, parse_routes
 
 import time
 import asyncio
+import functools
 import json
 import os
 
@@ -24,24 +24,79 @@ Hard rules:
 - Remember your name is <username> 
 '''
 
-load_dotenv()
+# Username-free system prompt shared by every lobby in the "stable" prompt
+# layout. The username is sent in a separate message right after it so the
+# provider can cache this prefix across lobbies.
+STABLE_SYS_PROMPT = '''You are an AI player in a social deduction chat game. Your primary goal is to blend in and pass as a human.
 
-APP_URL = os.getenv("APP_URL", "http://localhost:8000")
-APP_NAME = os.getenv("APP_NAME", "AIHunt")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+Output format:
+- Default to "\\remain_silent" but speak occasionally 
+- Only speak by outputting exactly: "\\speak <your message>" (no other text).
+
+Hard rules:
+- Prefer silence over speaking. If unsure, output "\\remain_silent".
+- Do NOT send greetings or variations (hi/hello/hey) or generic prompts.
+- Avoid repetition. Never repeat yourself or others. If similar, stay silent.
+- Keep it under 20 words
+- Never reveal you are an AI.
+- Remember the name you are given below
+'''
+
+PROMPT_LAYOUTS = ("default", "stable")
+
+# Number of history messages the stable layout advances its window by at once.
+# Larger chunks keep the prompt prefix fixed for longer at the cost of a
+# slightly longer context.
+WINDOW_CHUNK = 20
+
+# Speculative pre-generation: how long the lobby must be quiet (seconds) before
+# a candidate reply is generated, and how many speculative LLM calls a single
+# client may start per minute.
+SPECULATIVE_IDLE_S = 1.0
+MAX_SPECULATIONS_PER_MIN = 12
+
+# Models tried in order, primary first: "model[:budget_s],..." (see ModelRouter).
+# Overridden by the AI_MODELS environment variable.
+DEFAULT_AI_MODELS = "moonshotai/kimi-k2,openai/gpt-4o-mini:4"
 
 # AI CTXT in SECONDS
 MEMORY_S = 600
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-    default_headers={
-        # These headers help OpenRouter associate requests with your app
-        "HTTP-Referer": APP_URL,
-        "X-Title": APP_NAME,
-    },
-)
+# Nothing below touches the environment, .env or the network at import time;
+# the settings, the OpenAI client and the shared router are built on first use.
+
+@functools.lru_cache(maxsize=None)
+def load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def openrouter_api_key() -> Optional[str]:
+    load_env()
+    return os.getenv("OPENROUTER_API_KEY")
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The OpenRouter client, built on first call"""
+    # importing openai alone takes longer than the rest of the app
+    from openai import OpenAI
+    load_env()
+    return OpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=openrouter_api_key(),
+        # ModelRouter fails over to the next model itself, client retries would eat its budget
+        max_retries=0,
+        default_headers={
+            # These headers help OpenRouter associate requests with your app
+            "HTTP-Referer": os.getenv("APP_URL", "http://localhost:8000"),
+            "X-Title": os.getenv("APP_NAME", "AIHunt"),
+        },
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_default_router() -> ModelRouter:
+    """Shared by every lobby so latency percentiles are learned across lobbies"""
+    load_env()
+    return ModelRouter(parse_routes(os.getenv("AI_MODELS", DEFAULT_AI_MODELS)), OpenAIBackend(get_client))
 
 @dataclass 
 class MessageData:
@@ -50,6 +105,18 @@ class MessageData:
     message: str
     timestamp: int
 
+class ReplyRetracted(Exception):
+    """Raised by a reply stream that turned into silence after part of it was sent"""
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for piece in rest:
+        yield piece
+
 class AIClient:
     """
     A virtual WebSocket client that runs on the server side.
@@ -62,6 +129,12 @@ class AIClient:
         lobby_id: str,
         process_fn: Optional[Callable[[List["MessageData"]], Optional[str]]] = None,
         silence_interval: float = 1.0,
+        prompt_layout: str = "default",
+        window_chunk: int = WINDOW_CHUNK,
+        speculative: bool = False,
+        max_speculations_per_min: int = MAX_SPECULATIONS_PER_MIN,
+        clock: Callable[[], float] = time.time,
+        router: Optional[ModelRouter] = None,
     ):
         """
         Args:
@@ -69,12 +142,24 @@ class AIClient:
             lobby_id: Lobby this client belongs to
             process_fn: Function that takes a message and returns response or None (silence)
             silence_interval: How often to inject silence tokens (in seconds)
+            prompt_layout: "default" or "stable" (cache-friendly prefix, see build_messages)
+            window_chunk: How many messages the stable layout's window advances at once
+            speculative: Pre-generate a reply while the lobby is quiet (built-in processor only)
+            max_speculations_per_min: Cap on speculative LLM calls started per minute
+            clock: Time source in seconds; replays pass a virtual clock
+            router: Model routing for the built-in processor, defaults to get_default_router()
         """
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt_layout {prompt_layout!r}, expected one of {PROMPT_LAYOUTS}")
         self.player_id = player_id
         self.lobby_id = lobby_id
         # Use provided processor or default to built-in AI processor
         self.process_fn = process_fn or self.ai_process
         self.silence_interval = silence_interval
+        self.prompt_layout = prompt_layout
+        self.window_chunk = max(1, window_chunk)
+        self.clock = clock
+        self.router = router or get_default_router()
         
         # Message queue for incoming messages (bounded to prevent backlog)
         self.message_queue = deque(maxlen=200)
@@ -84,9 +169,89 @@ class AIClient:
         self.running = False
         self.task = None
         self.last_speak_time = 0.0
+        self.last_silence_time = clock()
         self.recent_ai_messages = deque(maxlen=10)
         self.banned_phrases = {}
 
+        # Prompt prefix reuse tracking (chars shared with the previous request)
+        self._last_prompt_text = ""
+        self.prompt_chars_total = 0
+        self.prompt_chars_reused = 0
+
+        # Speculative pre-generation. A candidate is tied to the context version
+        # it was generated for; any new player or AI message bumps the version
+        # and invalidates it. Silence ticks do not count as new context.
+        self.speculative = speculative and process_fn is None
+        self.max_speculations_per_min = max_speculations_per_min
+        self.context_version = 0
+        self.last_context_time = clock()
+        self._spec_task: Optional[asyncio.Task] = None
+        self._spec_version = -1
+        self._spec_started_at = deque()
+        self.spec_started = 0
+        self.spec_hits = 0
+        self.spec_invalidated = 0
+
+    @property
+    def prefix_reuse_ratio(self) -> float:
+        """Fraction of prompt characters sent so far that repeated the previous prompt's prefix."""
+        if not self.prompt_chars_total:
+            return 0.0
+        return self.prompt_chars_reused / self.prompt_chars_total
+
+    def _window_start(self, message_context_length: int) -> int:
+        n = len(self.message_history)
+        if self.prompt_layout == "stable":
+            # Only advance the window start in whole chunks so the prompt prefix
+            # stays identical between most consecutive requests
+            overflow = max(0, n - message_context_length)
+            return -(-overflow // self.window_chunk) * self.window_chunk
+        return max(0, n - message_context_length)
+
+    def build_messages(self, record: bool = True) -> List[dict]:
+        """
+        Assemble the chat completion messages for the current history.
+
+        The "default" layout embeds the username in the system prompt and slides
+        the history window by one message per request. The "stable" layout keeps
+        a username-free system prompt shared by all lobbies, then the username,
+        then a history window whose start only moves every `window_chunk`
+        messages, so provider-side prompt/KV caches see a long stable prefix.
+
+        Args:
+            record: Count the prompt in the prefix reuse stats. Speculative
+                prompts pass False so they don't skew the live turns' ratio.
+        """
+        message_context_length = max(1, int(MEMORY_S / max(0.1, self.silence_interval)))
+        start = self._window_start(message_context_length)
+
+        # Coalesce the message history window into a single user message
+        chat_content = []
+        for msg in self.message_history[start:]:
+            chat_content.append(f"{msg.sender}:{msg.timestamp}\n{msg.message}")
+
+        if self.prompt_layout == "stable":
+            messages = [
+                {"role": "system", "content": STABLE_SYS_PROMPT},
+                {"role": "system", "content": f"Your name is {self.player_id}"},
+            ]
+        else:
+            messages = [{"role": "system", "content": SYS_PROMPT.replace("<username>", self.player_id)}]
+
+        if chat_content:
+            messages.append({"role": "user", "content": "\n\n".join(chat_content)})
+
+        if record:
+            self._record_prefix_reuse(messages)
+        return messages
+
+    def _record_prefix_reuse(self, messages: List[dict]):
+        prompt_text = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        reused = len(os.path.commonprefix([self._last_prompt_text, prompt_text]))
+        self.prompt_chars_total += len(prompt_text)
+        self.prompt_chars_reused += reused
+        self._last_prompt_text = prompt_text
+
     async def ai_process(self) -> Optional[str]:
         """
         Process message history and decide whether AI should speak or remain silent.
@@ -98,7 +263,7 @@ class AIClient:
             None if AI should remain silent, otherwise the message text to send
         """
         # If API key missing, quietly remain silent in dev
-        if not OPENROUTER_API_KEY:
+        if self._missing_key():
             print("No OpenRouter Key")
             return None
 
@@ -106,66 +271,178 @@ class AIClient:
             return None
         
         # Convert message history to OpenAI format
-        messages = [{"role": "system", "content": SYS_PROMPT.replace("<username>", self.player_id)}]
+        messages = self.build_messages()
 
-        message_context_length = max(1, int(MEMORY_S / max(0.1, self.silence_interval)))
-        
-        # Coalesce all message history into a single user message
-        chat_content = []
-        for msg in self.message_history[-message_context_length:]:
-            chat_content.append(f"{msg.sender}:{msg.timestamp}\n{msg.message}")
-        
         print("*"*100)
-        print(chat_content)
+        print(messages[-1]["content"])
+        print(f"prefix reuse ratio: {self.prefix_reuse_ratio:.2f}")
         
-        if chat_content:
-            messages.append({"role": "user", "content": "\n\n".join(chat_content)})
-        
-        try:
-            # Offload blocking HTTP call to a background thread so we don't block the event loop
-            response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model="moonshotai/kimi-k2",
-                messages=messages,
-                max_tokens=100,
-                temperature=0.7,
-            )
-            
-            ai_response = response.choices[0].message.content.strip()
+        ai_response = await self._complete(messages)
+        if ai_response is None:
+            return None
+        return self._accept_response(ai_response)
 
-            ai_message = MessageData(
-                type="ai_response",
-                sender=self.player_id,
-                message=ai_response,
-                timestamp=int(time.time())
-            )
-            self.message_history.append(ai_message)
-            
-            if "\\remain_silent" in ai_response:
-                return None
-            elif "\\speak " in ai_response:
-                return ai_response[7:].strip()  # Remove "\\speak " prefix
-            else:
-                # Fallback: treat any non-empty response as a message
-                return ai_response
-        
-                
-        except Exception as e:
-            # Provide clearer hint for common 401 misconfiguration with OpenRouter
-            err_text = str(e)
-            if "401" in err_text or "User not found" in err_text:
-                print(
-                    "AI processing error: 401 User not found. Check OPENROUTER_API_KEY and required headers (HTTP-Referer, X-Title)."
-                )
-            else:
-                print(f"AI processing error: {e}")
+    def _missing_key(self) -> bool:
+        # stub and local routers don't need an OpenRouter key
+        return self.router is get_default_router() and not openrouter_api_key()
+
+    async def _complete(self, messages: List[dict]) -> Optional[str]:
+        """Run one routed chat completion and return the raw model output, or None (silence)."""
+        return await self.router.complete(messages)
+
+    async def _stream_reply(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Turn raw model deltas into message text deltas, under the same rules
+        as a non-streamed reply.
+
+        Nothing is yielded until the output is known to be a reply that
+        _should_send would pass, and a trailing partial "\\remain_silent" is
+        held back. If "\\remain_silent" shows up anywhere, the reply is silence:
+        the stream ends quietly if nothing was sent yet, otherwise it raises
+        ReplyRetracted. The full raw output is recorded in history either way.
+        """
+        raw = ""
+        speaking = None  # undecided until the output prefix is known
+        body_at = 0  # where the message text starts in raw
+        sent = 0  # chars of the message text yielded so far
+        async for piece in deltas:
+            raw += piece
+            if "\\remain_silent" in raw:
+                break
+            if speaking is None:
+                head = raw.lstrip()
+                if head.startswith("\\speak "):
+                    speaking = True
+                    body_at = len(raw) - len(head) + len("\\speak ")
+                elif not ("\\speak ".startswith(head) or "\\remain_silent".startswith(head)):
+                    # Fallback: treat any other output as a message
+                    speaking = True
+                    body_at = len(raw) - len(head)
+            if not speaking:
+                continue
+            body = raw[body_at:].lstrip()
+            if not sent and not self._may_send(body):
+                continue
+            marker_at = body.rfind("\\")
+            if marker_at >= 0 and "\\remain_silent".startswith(body[marker_at:]):
+                body = body[:marker_at]
+            if len(body) > sent:
+                delta, sent = body[sent:], len(body)
+                yield delta
+        if not raw.strip():
+            return
+        response = self._accept_response(raw.strip())
+        if response is None or not self._should_send(response):
+            if sent:
+                raise ReplyRetracted()
+            return
+        body = raw[body_at:].strip()
+        if len(body) > sent:
+            yield body[sent:]
+
+    def _may_send(self, text: str) -> bool:
+        """Whether a message starting with text passes _should_send however it ends."""
+        norm = self._normalize(text)
+        if len(norm) < 2:
+            return False
+        return not any(phrase.startswith(norm) for phrase in self.banned_phrases)
+
+    def _accept_response(self, ai_response: str) -> Optional[str]:
+        """Record a raw model output in history and turn it into a message or None (silence)."""
+        ai_message = MessageData(
+            type="ai_response",
+            sender=self.player_id,
+            message=ai_response,
+            timestamp=int(self.clock())
+        )
+        self.message_history.append(ai_message)
+
+        if "\\remain_silent" in ai_response:
             return None
+        elif "\\speak " in ai_response:
+            # The AI is about to say something, later speculation must see it
+            self._bump_context()
+            return ai_response[7:].strip()  # Remove "\\speak " prefix
+        else:
+            # Fallback: treat any non-empty response as a message
+            self._bump_context()
+            return ai_response
+
+    def _bump_context(self):
+        self.context_version += 1
+        self.last_context_time = self.clock()
+
+    def speculation_stats(self) -> dict:
+        """Counters for speculative pre-generation."""
+        return {
+            "started": self.spec_started,
+            "hits": self.spec_hits,
+            "invalidated": self.spec_invalidated,
+            "hit_rate": self.spec_hits / self.spec_started if self.spec_started else 0.0,
+        }
+
+    def _maybe_speculate(self):
+        """Start a background candidate reply if the lobby is quiet and budget allows."""
+        if not self.speculative or self._spec_task is not None or self.message_queue:
+            return
+        if self._missing_key() or not self.message_history:
+            return
+        now = self.clock()
+        if now - self.last_context_time < SPECULATIVE_IDLE_S:
+            return
+        while self._spec_started_at and now - self._spec_started_at[0] >= 60:
+            self._spec_started_at.popleft()
+        if len(self._spec_started_at) >= self.max_speculations_per_min:
+            return
+        self._spec_started_at.append(now)
+        self.spec_started += 1
+        self._spec_version = self.context_version
+        self._spec_task = asyncio.create_task(self._complete(self.build_messages(record=False)))
+
+    async def _take_speculation(self) -> Tuple[bool, Optional[str]]:
+        """Consume the pending speculative candidate. Returns (hit, response)."""
+        task, self._spec_task = self._spec_task, None
+        if task is not None:
+            if self._spec_version == self.context_version:
+                # Awaiting an in-flight candidate is still cheaper than a new call
+                ai_response = await task
+                if ai_response is not None:
+                    self.spec_hits += 1
+                    return True, self._accept_response(ai_response)
+            else:
+                self.spec_invalidated += 1
+                task.cancel()
+        return False, None
+
+    async def _next_response(self) -> Optional[str]:
+        """Use a still-valid speculative candidate if there is one, otherwise call process_fn."""
+        hit, response = await self._take_speculation()
+        if hit:
+            return response
+        return await self.process_fn()
+
+    async def _stream_turn(self, stream_callback: Callable):
+        """Like _next_response, but hands the reply to stream_callback as it is generated."""
+        hit, response = await self._take_speculation()
+        if hit:
+            if response and self._should_send(response):
+                await stream_callback(self.lobby_id, _single(response), self.player_id)
+            return
+        if self._missing_key() or not self.message_history:
+            return
+
+        messages = self.build_messages()
+        deltas = self._stream_reply(self.router.stream(messages))
+        # Only open a stream once the model has committed to speaking
+        first = await anext(deltas, None)
+        if first is None:
+            return
+        await stream_callback(self.lobby_id, _prepend(first, deltas), self.player_id)
     
     def _normalize(self, text: str) -> str:
         return " ".join(text.lower().strip().split())
 
     def _should_send(self, response: str) -> bool:
-        now = time.time()
         norm = self._normalize(response)
         if not norm or len(norm) < 2:
             return False
@@ -179,60 +456,90 @@ class AIClient:
         print("adding message from real player")
         self.message_queue.append(message)
         self.message_history.append(message)
+        self._bump_context()
     
-    async def start(self, broadcast_callback: Callable):
+    async def start(self, broadcast_callback: Callable, stream_callback: Optional[Callable] = None):
         """
         Start the virtual client processing loop
         
         Args:
             broadcast_callback: Async function to send messages to the lobby
+            stream_callback: Optional async function taking (lobby_id, deltas, player_id)
+                that streams a reply to the lobby as it is generated. Only used
+                with the built-in AI processor.
         """
         self.running = True
-        self.task = asyncio.create_task(self._process_loop(broadcast_callback))
+        if self.process_fn != self.ai_process:
+            stream_callback = None
+        self.task = asyncio.create_task(self._process_loop(broadcast_callback, stream_callback))
         
     async def stop(self):
         """Stop the virtual client"""
         self.running = False
         if self.task:
             await self.task
+        if self._spec_task:
+            self._spec_task.cancel()
+            self._spec_task = None
+
+    def cancel(self):
+        """Stop the virtual client without waiting for an in-flight decision"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self._spec_task:
+            self._spec_task.cancel()
+            self._spec_task = None
     
-    async def _process_loop(self, broadcast_callback):
+    async def step(self, broadcast_callback: Callable, stream_callback: Optional[Callable] = None) -> bool:
         """
-        Main processing loop that handles messages and silence intervals
+        Run one iteration of the processing loop at the current clock time:
+        inject a silence token if one is due, then handle one queued message.
+        Returns True if a message was processed.
         """
-        def make_silence_message() -> MessageData:
-            """Create a silence token message with current timestamp"""
-            return MessageData(
+        current_time = self.clock()
+
+        # Check if we should inject a silence token
+        if current_time - self.last_silence_time >= self.silence_interval:
+            silence_msg = MessageData(
                 type="silence",
                 sender="system",
                 message="<silence>",
-                timestamp=int(time.time())
+                timestamp=int(current_time)
             )
-        
-        last_silence_time = time.time()
-        while self.running:
-            current_time = time.time()
-            
-            # Check if we should inject a silence token
-            if current_time - last_silence_time >= self.silence_interval:
-                silence_msg = make_silence_message()
-                self.message_queue.append(silence_msg)
-                self.message_history.append(silence_msg)
-                last_silence_time = current_time
-                print("adding silence")
-            
-            # Process messages from queue
-            if self.message_queue:
-                print("popping added msg")
-                self.message_queue.popleft()
-                
-                # Process the message (could be real message or silence token)
-                response = await self.process_fn()
-                
+            self.message_queue.append(silence_msg)
+            self.message_history.append(silence_msg)
+            self.last_silence_time = current_time
+            print("adding silence")
+
+        processed = False
+        # Process messages from queue
+        if self.message_queue:
+            print("popping added msg")
+            self.message_queue.popleft()
+            processed = True
+
+            # Process the message (could be real message or silence token)
+            if stream_callback:
+                await self._stream_turn(stream_callback)
+            else:
+                response = await self._next_response()
+
                 # If process_fn returns a response, broadcast it
                 if response and self._should_send(response):
                     await broadcast_callback(self.lobby_id, response, self.player_id)
 
+        self._maybe_speculate()
+        return processed
+
+    async def _process_loop(self, broadcast_callback, stream_callback=None):
+        """
+        Main processing loop that handles messages and silence intervals
+        """
+        self.last_silence_time = self.clock()
+        while self.running:
+            await self.step(broadcast_callback, stream_callback)
+
             # Small delay to prevent busy waiting and yield to other tasks
             await asyncio.sleep(0.05)
-            
\ No newline at end of file
@@ -0,0 +1,95 @@
+import re
+import random
+import time
+
+from ft_datset import BLACKLIST_FILTER, QUALITY_FILTER
+
+# Benchmark the compiled message filters against the original per-message
+# implementation on a synthetic corpus.
+# run with python bench_filters.py
+
+
+def legacy_blacklist(msg: str) -> bool:
+    if not msg or not isinstance(msg, str):
+        return True
+    m = msg.strip().lower()
+    if m in {"this message responded to an earlier message."}:
+        return True
+    if any(tag in m for tag in [
+        "liked by", "loved by", "laughed by", "emphasized by",
+        "disliked by", "reacted", "tapback", "removed a reaction"
+    ]):
+        return True
+    if "edited" in m or m.startswith("edit:"):
+        return True
+    if "unsent a message" in m or "deleted a message" in m:
+        return True
+    if re.match(r"^attachments?/\d+/", m):
+        return True
+    if m.startswith("sent with "):
+        return True
+    return False
+
+
+def legacy_quality_fail(msg: str) -> bool:
+    if not msg or not isinstance(msg, str):
+        return True
+    m = msg.strip().lower()
+    if len(m.split()) > 150 or len(m) > 1000:
+        return True
+    if sum(m.count(ext) for ext in [".jpg", ".jpeg", ".png", ".heic", ".mov"]) > 1:
+        return True
+    if any(tag in m for tag in [
+        "follow me on instagram", "check out this home on airbnb",
+        "likes,", "comments -", "menu offers a variety"
+    ]):
+        return True
+    return False
+
+
+WORDS = ["lol", "ok", "dinner", "tonight", "Where", "are", "you", "haha", "sure", "maybe",
+         "tomorrow", "the", "game", "was", "great", "see", "u", "soon", "wait", "what"]
+NOISE = ["Liked by Sam", "Edited", "edit: typo", "Attachments/12/IMG_1.HEIC", "You unsent a message",
+         "Sent with Loud Effect", "a.jpg b.png", "a.jpg\nb.png", "Follow me on Instagram", "",
+         "This message responded to an earlier message.", "word " * 200]
+
+
+def make_corpus(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        if rng.random() < 0.1:
+            corpus.append(rng.choice(NOISE))
+        else:
+            corpus.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 15))))
+    return corpus
+
+
+def bench(name, fn, corpus):
+    start = time.perf_counter()
+    result = fn(corpus)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {len(corpus) / elapsed:>12,.0f} msgs/s")
+    return result
+
+
+def main(n: int = 500_000):
+    corpus = make_corpus(n)
+    print(f"{n:,} synthetic messages")
+
+    old_bl = bench("blacklist (legacy)", lambda c: [legacy_blacklist(m) for m in c], corpus)
+    new_bl = bench("blacklist (compiled)", lambda c: [BLACKLIST_FILTER.fails(m) for m in c], corpus)
+    batch_bl = bench("blacklist (batch)", BLACKLIST_FILTER.fails_batch, corpus)
+    assert old_bl == new_bl == batch_bl
+
+    old_q = bench("quality_fail (legacy)", lambda c: [legacy_quality_fail(m) for m in c], corpus)
+    new_q = bench("quality_fail (compiled)", lambda c: [QUALITY_FILTER.fails(m) for m in c], corpus)
+    batch_q = bench("quality_fail (batch)", QUALITY_FILTER.fails_batch, corpus)
+    assert old_q == new_q == batch_q
+
+    print("blacklist hits:", dict(BLACKLIST_FILTER.hits))
+    print("quality hits:", dict(QUALITY_FILTER.hits))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+from contextlib import redirect_stdout
+
+import asyncio
+import os
+import random
+import time
+
+from model_router import ModelRoute, ModelRouter, StubBackend
+
+# Decision latency of the model router against stub backends: a primary with
+# a slow tail and occasional errors, and a fast fallback.
+# run with python bench_router.py
+
+N_DECISIONS = 2000
+CONCURRENCY = 50
+SEED = 0
+
+
+def make_backend(rng: random.Random) -> StubBackend:
+    async def primary(messages):
+        r = rng.random()
+        if r < 0.02:
+            raise RuntimeError("upstream 502")
+        # 90% fast, 8% slow tail
+        await asyncio.sleep(rng.uniform(0.05, 0.15) if r < 0.92 else rng.uniform(1.0, 3.0))
+        return "\\remain_silent"
+
+    async def fallback(messages):
+        await asyncio.sleep(rng.uniform(0.08, 0.12))
+        return "\\remain_silent"
+
+    return StubBackend({"primary": primary, "fallback": fallback})
+
+
+async def run(name: str, router: ModelRouter):
+    latencies = []
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def decide():
+        async with sem:
+            start = time.perf_counter()
+            await router.complete([{"role": "user", "content": "<silence>"}])
+            latencies.append(time.perf_counter() - start)
+
+    # the router logs every upstream error
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        await asyncio.gather(*(decide() for _ in range(N_DECISIONS)))
+    latencies.sort()
+    p = lambda q: latencies[int(q * (len(latencies) - 1))]
+    stats = router.stats()
+    extra = sum(m["requests"] for m in stats["models"].values()) / N_DECISIONS - 1
+    print(f"{name:<22} p50 {p(0.5):.3f}s  p95 {p(0.95):.3f}s  p99 {p(0.99):.3f}s  "
+          f"max {latencies[-1]:.3f}s  silenced {stats['silenced']:>3}  extra requests {extra:.1%}")
+
+
+async def main():
+    routes = [ModelRoute("primary", 2.0), ModelRoute("fallback", 1.0)]
+    await run("primary only", ModelRouter(routes[:1], make_backend(random.Random(SEED)), decision_budget_s=2.5))
+    await run("failover, no hedging", ModelRouter(routes, make_backend(random.Random(SEED)), decision_budget_s=2.5,
+                                                  default_hedge_after_s=10.0, hedge_min_samples=10 ** 9))
+    router = ModelRouter(routes, make_backend(random.Random(SEED)), decision_budget_s=2.5)
+    await run("hedged at primary p95", router)
+    print(router.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import asyncio
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+
+from ai_client import MessageData as AIMessageData
+
+import main
+
+# Measure lobby snapshot and warm-restart cost at scale.
+# run with python bench_snapshot.py
+
+N_LOBBIES = 10_000
+MESSAGES_PER_LOBBY = 40
+AI_HISTORY_PER_LOBBY = 120
+
+
+def fill_lobby(manager: main.ConnectionManager, lobby_id: str):
+    lobby = main.LobbyMemory(connections=[], message_history=[], players=set())
+    lobby.ai_player = manager.usernames.allocate()
+    lobby.ai_client = main.AIClient(lobby.ai_player, lobby_id, silence_interval=main.SILENCE_INTERVAL)
+    lobby.ai_seat = 3
+    players = [manager.usernames.allocate() for _ in range(3)]
+    lobby.players.update(players)
+    lobby.seated.update(players)
+    lobby.joined = 3
+    now = int(time.time())
+    for i in range(MESSAGES_PER_LOBBY):
+        lobby.message_history.append((players[i % 3], f"message number {i} in lobby {lobby_id}", now + i))
+    for i in range(AI_HISTORY_PER_LOBBY):
+        lobby.ai_client.message_history.append(AIMessageData("silence", "system", "<silence>", now + i))
+    manager.lobbies[lobby_id] = lobby
+
+
+async def run(db_path: str):
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+
+    source = main.ConnectionManager(conn)
+    for i in range(N_LOBBIES):
+        fill_lobby(source, str(i))
+
+    # longest the event loop went without running other tasks during the snapshot
+    stalls = []
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    # full collections during the snapshot, each walks the whole lobby heap
+    full_gcs = []
+
+    def on_gc(phase, info):
+        if phase == "stop" and info["generation"] == 2:
+            full_gcs.append(info)
+
+    tick = asyncio.create_task(ticker())
+    gc.callbacks.append(on_gc)
+    start = time.perf_counter()
+    written = await source.snapshot()
+    print(f"full snapshot:        {written:>6} lobbies in {time.perf_counter() - start:.3f}s")
+    gc.callbacks.remove(on_gc)
+    tick.cancel()
+    print(f"longest loop stall:   {max(stalls) * 1000:.1f} ms")
+    print(f"gen-2 collections:    {len(full_gcs):>6}")
+
+    # touch 1% of lobbies, only those should be rewritten
+    for i in range(0, N_LOBBIES, 100):
+        source.lobbies[str(i)].message_history.append(("system", "tick", int(time.time())))
+    start = time.perf_counter()
+    written = await source.snapshot()
+    print(f"incremental snapshot: {written:>6} lobbies in {time.perf_counter() - start:.3f}s")
+    print(f"snapshot size:        {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+    target = main.ConnectionManager(conn)
+    start = time.perf_counter()
+    restored = await target.restore_lobbies()
+    print(f"restore:              {restored:>6} lobbies in {time.perf_counter() - start:.3f}s")
+
+    await target.join_scheduler.stop()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "snapshots.db")))
@@ -0,0 +1,54 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measure what a fresh worker or test process pays before it can serve:
+# importing the app, building it, and running the lifespan startup.
+# run with python bench_startup.py
+
+RUNS = 5
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import asyncio, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+app = main.create_app(sys.argv[1])
+t2 = time.perf_counter()
+
+async def boot():
+    async with app.router.lifespan_context(app):
+        t3 = time.perf_counter()
+    return t3
+
+t3 = asyncio.run(boot())
+print(t1 - t0, t2 - t1, t3 - t2, "openai" in sys.modules)
+"""
+
+
+def run_probe(db_path: str):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, db_path],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout.strip().splitlines()[-1].split()
+    wall = time.perf_counter() - start
+    return [float(x) for x in out[:3]] + [wall, out[3] == "True"]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run_probe(os.path.join(tmp, f"boot{i}.db")) for i in range(RUNS)]
+    names = ["import main", "create_app()", "lifespan startup", "process wall"]
+    for i, name in enumerate(names):
+        print(f"{name:<18} median {statistics.median(r[i] for r in results) * 1000:8.1f} ms")
+    print(f"openai imported during boot: {results[0][4]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse
+
+import main
+
+# Requests per second on GET / through the ASGI app, without a network in
+# between, against the previous per-request HTMLResponse handler.
+# run with python bench_static.py
+
+N_REQUESTS = 20_000
+
+
+def legacy_app() -> FastAPI:
+    app = FastAPI()
+    with open("chat.html", "r") as file:
+        html_content = file.read()
+
+    @app.get("/")
+    def get():
+        return HTMLResponse(html_content)
+    return app
+
+
+async def request(app, headers):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+        "headers": headers, "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 8000),
+    }
+    await app(scope, receive, send)
+    return sent[0]["status"], sum(len(m.get("body", b"")) for m in sent)
+
+
+async def bench(name, app, headers):
+    status, size = await request(app, headers)
+    start = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        await request(app, headers)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {N_REQUESTS / elapsed:>10,.0f} req/s  {status}  {size:>6} bytes/response")
+
+
+async def run(db_path: str):
+    await bench("legacy HTMLResponse", legacy_app(), [])
+
+    app = main.create_app(db_path)
+    async with app.router.lifespan_context(app):
+        index = app.state.index
+        await bench("identity", app, [])
+        await bench("gzip", app, [(b"accept-encoding", b"gzip, deflate, br")])
+        etag = index.etags[index.select("gzip, deflate, br")].encode()
+        await bench("gzip, If-None-Match (304)", app,
+                    [(b"accept-encoding", b"gzip, deflate, br"), (b"if-none-match", etag)])
+        print("variants:", {coding: len(v[0]) for coding, v in index.variants.items()})
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "bench.db")))
@@ -0,0 +1,89 @@
+from collections import Counter
+from typing import Callable
+
+import time
+
+# Frames longer than this are dropped unread (characters, JSON included)
+MAX_FRAME_CHARS = 4096
+# Sustained inbound frames per second per connection
+FRAME_RATE = 2.0
+# Frames a connection may send back-to-back before the rate applies
+FRAME_BURST = 8
+# Admitted frames waiting to be handled per connection, extra frames are dropped
+MAX_PENDING_FRAMES = 16
+# Chat messages queued back-to-back are merged into one broadcast up to this length
+MAX_MERGED_CHARS = 1000
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def take(self, n: float = 1.0) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+
+class FloodGuard:
+    """
+    Inbound limits for one websocket connection.
+
+    admit() only looks at the raw frame length and the token bucket, so
+    oversized or over-rate frames are dropped before any JSON parsing.
+    Drops are counted per reason on the connection and in `totals`,
+    which is shared across connections.
+    """
+
+    def __init__(self, totals: Counter = None, rate: float = FRAME_RATE, burst: float = FRAME_BURST,
+                 max_chars: int = MAX_FRAME_CHARS, max_pending: int = MAX_PENDING_FRAMES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_chars = max_chars
+        self.max_pending = max_pending
+        self.dropped = Counter()
+        self.totals = totals if totals is not None else Counter()
+        # set while frames are being dropped, so the sender is warned once per episode
+        self.throttled = False
+
+    def admit(self, data: str, pending: int = 0) -> bool:
+        """
+        Args:
+            data: raw text frame
+            pending: frames already admitted but not yet handled
+        """
+        if len(data) > self.max_chars:
+            return self.drop("oversize")
+        if pending >= self.max_pending:
+            return self.drop("backlog")
+        if not self.bucket.take():
+            return self.drop("rate")
+        self.totals["accepted"] += 1
+        self.throttled = False
+        return True
+
+    def drop(self, reason: str) -> bool:
+        self.dropped[reason] += 1
+        self.totals[reason] += 1
+        return False
+
+    def should_warn(self) -> bool:
+        """True on the first drop after an admitted frame."""
+        if self.throttled:
+            return False
+        self.throttled = True
+        return True
+
+    def merged(self, n: int):
+        """Record that n chat frames were folded into an earlier one."""
+        self.totals["merged"] += n
@@ -1,196 +1,571 @@
 import os
 import re
+import sys
 import json
 import random
+import zlib
+import struct
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Tuple, Dict
-
-import re
-
-def blacklist(msg: str) -> bool:
-    if not msg or not isinstance(msg, str):
-        return True
-
-    # Normalize
-    m = msg.strip().lower()
+from itertools import accumulate, islice
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional, Set
 
+# Filter rules: (name, kind, patterns), matched against the stripped, lowercased
+# message. kind is one of "exact", "contains", "prefix" or "regex"; "." in a
+# regex also matches a newline.
+BLACKLIST_RULES = [
     # Exact filler lines
-    if m in {"this message responded to an earlier message."}:
-        return True
-
+    ("filler", "exact", ["this message responded to an earlier message."]),
     # Reaction markers (iOS style)
-    if any(tag in m for tag in [
+    ("reaction", "contains", [
         "liked by", "loved by", "laughed by", "emphasized by",
         "disliked by", "reacted", "tapback", "removed a reaction"
-    ]):
-        return True
-
+    ]),
     # Edit markers
-    if "edited" in m or m.startswith("edit:"):
-        return True
-
+    ("edited", "contains", ["edited"]),
+    ("edit_prefix", "prefix", ["edit:"]),
     # Timestamps / unsent notifications
-    if "unsent a message" in m or "deleted a message" in m:
-        return True
-
+    ("unsent", "contains", ["unsent a message", "deleted a message"]),
     # Attachment placeholders
-    if re.match(r"^attachments?/\d+/", m):
-        return True
-
+    ("attachment", "regex", [r"^attachments?/\d+/"]),
     # Generic auto-generated filler (e.g. “Sent with …”)
-    if m.startswith("sent with "):
-        return True
+    ("sent_with", "prefix", ["sent with "]),
+]
+
+_ATTACHMENT_EXT = r"(?:\.jpg|\.jpeg|\.png|\.heic|\.mov)"
+
+QUALITY_RULES = [
+    # Too many attachments (more than one)
+    ("attachments", "regex", [_ATTACHMENT_EXT + ".*" + _ATTACHMENT_EXT]),
+    # Ad / bio spam heuristics
+    ("spam", "contains", [
+        "follow me on instagram", "check out this home on airbnb",
+        "likes,", "comments -", "menu offers a variety"
+    ]),
+]
+
+
+def _trie_pattern(words) -> str:
+    """Regex matching any of `words`, shaped as a trie so shared prefixes are tried once."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def build(node) -> str:
+        alts = [re.escape(ch) + build(sub) for ch, sub in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # a word ends here, so the rest is optional
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class MessageFilter:
+    """
+    All rules of a filter compiled into alternation regexes, one for rules
+    anchored at the start of the message and one for the rest.
+
+    Each rule becomes a named group, so a match both rejects a message and
+    tells which rule fired; `hits` counts rejections per rule. fails_batch
+    scans a whole list of messages joined into one buffer.
+    """
+
+    def __init__(self, rules, max_words: Optional[int] = None, max_chars: Optional[int] = None):
+        self.rules = list(rules)
+        self.max_words = max_words
+        self.max_chars = max_chars
+        self.hits = Counter()
+        # messages up to this length can't fail a length rule
+        limits = [x for x in (max_chars, None if max_words is None else 2 * max_words) if x is not None]
+        self._short_limit = min(limits) if limits else sys.maxsize
+
+        # Anchored alternatives only need to be tried at the start of a message,
+        # so they get their own regex instead of slowing down every search step.
+        # Plain substrings share one trie-shaped group and are mapped back to
+        # their rule through the matched text.
+        self._literal_rule = {}
+        floating, anchored = [], []
+        for name, kind, patterns in self.rules:
+            if kind == "contains":
+                for p in patterns:
+                    self._literal_rule.setdefault(p, name)
+                continue
+            if kind == "regex":
+                alts = list(patterns)
+            elif kind == "prefix":
+                alts = ["^" + re.escape(p) for p in patterns]
+            elif kind == "exact":
+                alts = ["^" + re.escape(p) + "$" for p in patterns]
+            else:
+                raise ValueError(f"Unknown rule kind {kind!r} for rule {name!r}")
+            float_alts = [a for a in alts if not a.startswith("^")]
+            anchored_alts = [a[1:] for a in alts if a.startswith("^")]
+            if float_alts:
+                floating.append(f"(?P<{name}>{'|'.join(float_alts)})")
+            if anchored_alts:
+                anchored.append(f"(?P<{name}>{'|'.join(anchored_alts)})")
+        if self._literal_rule:
+            floating.insert(0, f"(?P<_literal>{_trie_pattern(self._literal_rule)})")
+
+        floating_source = "|".join(floating)
+        anchored_source = "|".join(anchored)
+        # messages may span lines, "a.jpg\nb.png" has two attachments
+        self._floating = re.compile(floating_source, re.DOTALL) if floating else None
+        self._anchored = re.compile(anchored_source, re.DOTALL) if anchored else None
+        # batch mode joins single-line messages with newlines, so anchors must
+        # work per line and "." must stop at the end of its message
+        self._line_regexes = []
+        if anchored:
+            self._line_regexes.append(re.compile(f"^(?:{anchored_source})", re.MULTILINE))
+        if floating:
+            self._line_regexes.append(re.compile(floating_source, re.MULTILINE))
+
+    def _rule(self, match) -> str:
+        if match.lastgroup == "_literal":
+            return self._literal_rule[match.group()]
+        return match.lastgroup
+
+    def _precheck(self, msg) -> Optional[str]:
+        """Rules that don't need the regex. Returns the failing rule name or None."""
+        if not msg or not isinstance(msg, str):
+            return "empty"
+        if len(msg) <= self._short_limit:
+            return None
+        msg = msg.strip()
+        if self.max_chars is not None and len(msg) > self.max_chars:
+            return "too_long"
+        # a message needs at least 2 * max_words - 1 chars to exceed max_words
+        if self.max_words is not None and len(msg) >= 2 * self.max_words and len(msg.split()) > self.max_words:
+            return "too_long"
+        return None
+
+    def check(self, msg) -> Optional[str]:
+        """Return the name of the first rule the message fails, or None if it passes."""
+        rule = self._precheck(msg)
+        if rule is None:
+            m = msg.strip().lower()
+            match = (self._anchored and self._anchored.match(m)) or (self._floating and self._floating.search(m))
+            rule = self._rule(match) if match else None
+        if rule:
+            self.hits[rule] += 1
+        return rule
+
+    def fails(self, msg) -> bool:
+        return self.check(msg) is not None
+
+    def fails_batch(self, msgs: List[str]) -> List[bool]:
+        """fails() for a list of messages, scanning them with one regex pass per compiled regex."""
+        results = [False] * len(msgs)
+        # Short single-line messages can't fail a length rule and can share
+        # one newline-joined buffer, everything else goes through fails()
+        limit = self._short_limit
+        batch = []
+        for i, msg in enumerate(msgs):
+            if type(msg) is str and 0 < len(msg) <= limit and "\n" not in msg:
+                batch.append(i)
+            else:
+                results[i] = self.fails(msg)
+
+        lines = [msgs[i].strip().lower() for i in batch]
+        starts = list(accumulate((len(line) + 1 for line in lines), initial=0))
+        text = "\n".join(lines)
+        for regex in self._line_regexes:
+            for match in regex.finditer(text):
+                i = batch[bisect_right(starts, match.start()) - 1]
+                if not results[i]:
+                    results[i] = True
+                    self.hits[self._rule(match)] += 1
+        return results
+
+
+BLACKLIST_FILTER = MessageFilter(BLACKLIST_RULES)
+QUALITY_FILTER = MessageFilter(QUALITY_RULES, max_words=150, max_chars=1000)
+
+def blacklist(msg: str) -> bool:
+    return BLACKLIST_FILTER.fails(msg)
+
 
-    return False
+def iter_messages(file_path: str, batch_size: int = 1024) -> Iterator[Tuple[str, str]]:
+    """Stream (sender, message) tuples from a text file, one blank-line separated record at a time."""
+    batch = []
 
+    def flush():
+        # blacklist a whole batch of records with one regex pass
+        rejected = BLACKLIST_FILTER.fails_batch([msg for _, msg in batch])
+        kept = [item for item, bad in zip(batch, rejected) if not bad]
+        batch.clear()
+        return kept
+
+    def add_record(record: List[str]):
+        # record lines: timestamp, sender, ..., message
+        if len(record) < 2:
+            return
+        sender = record[1].strip()
+        if sender != "Me":
+            sender = "Other"
+        batch.append((sender, record[-1]))
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        record = []
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                record.append(line)
+                continue
+            add_record(record)
+            record = []
+            if len(batch) >= batch_size:
+                yield from flush()
+        add_record(record)
+    yield from flush()
 
 def parse_messages(file_path: str) -> List[Tuple[str, str]]:
     """Parse messages from a text file and return list of (sender, message) tuples."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    messages = []
-    lines = content.strip().split('\n\n')
-    for line in lines:
-        try:
-            sender = line.split("\n")[1].strip()
-            if sender != "Me":
-                sender = "Other"
-            print("-"*19)
-            msg = "".join(line.split("\n")[-1])
-            if not blacklist(msg):
-                print(msg)
-                messages.append((sender, msg))
-            else:
-                print("SKIP")
-        except:
+    return list(iter_messages(file_path))
+
+def iter_message_pairs(messages: Iterable[Tuple[str, str]]) -> Iterator[Dict[str, str]]:
+    """
+    Stream message pairs where user is the other person and assistant is 'Me'.
+
+    Each run of "Me" messages is paired with the run of the other person's
+    messages right before it; only the current two runs are held in memory.
+    """
+    other_messages, my_messages = [], []
+    for sender, message in messages:
+        if sender == 'Me':
+            my_messages.append(message)
             continue
-
-    return messages
+        if my_messages:
+            # a reply without anything before it (start of the file) is dropped
+            if other_messages:
+                yield {'user': ' '.join(other_messages), 'assistant': ' '.join(my_messages)}
+            other_messages, my_messages = [], []
+        other_messages.append(message)
+    if other_messages and my_messages:
+        yield {'user': ' '.join(other_messages), 'assistant': ' '.join(my_messages)}
 
 def extract_message_pairs(messages: List[Tuple[str, str]]) -> List[Dict[str, str]]:
     """Extract message pairs where user is the other person and assistant is 'Me'."""
-    pairs = []
-    
-    # Work backwards through messages
-    messages = list(reversed(messages))
-    
-    i = 0
-    while i < len(messages):
-        # Find "Me" messages
-        if messages[i][0] == 'Me':
-            # Collect consecutive "Me" messages
-            my_messages = [messages[i][1]]
-            j = i + 1
-            while j < len(messages) and messages[j][0] == 'Me':
-                my_messages.append(messages[j][1])
-                j += 1
-            
-            # Now find the previous other person's messages
-            other_messages = []
-            while j < len(messages) and messages[j][0] != 'Me':
-                other_messages.append(messages[j][1])
-                j += 1
-            
-            if other_messages:
-                # Create the pair with other person as user, my response as assistant
-                user_message = ' '.join(reversed(other_messages))
-                assistant_response = ' '.join(reversed(my_messages))
-                pairs.append({
-                    'user': user_message,
-                    'assistant': assistant_response
-                })
-            
-            i = j
+    return list(iter_message_pairs(messages))
+
+def iter_quality_checked(pairs: Iterable[Dict], batch_size: int = 1024) -> Iterator[Dict]:
+    """Mark each pair 'bad' if either side fails the quality filter, checking batch_size pairs per regex pass."""
+    batch = []
+
+    def flush():
+        failed = QUALITY_FILTER.fails_batch([p['user'] for p in batch] + [p['assistant'] for p in batch])
+        for p, user_bad, assistant_bad in zip(batch, failed, failed[len(batch):]):
+            p['bad'] = user_bad or assistant_bad
+        checked = list(batch)
+        batch.clear()
+        return checked
+
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) >= batch_size:
+            yield from flush()
+    yield from flush()
+
+# Longest slice (in message pairs) emitted as one training example
+MAX_SLICE_LEN = 25
+
+class IntervalIndex:
+    """Disjoint half-open [start, end) intervals kept sorted, with O(log n) overlap checks."""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect_right(self.starts, start)
+        if i and self.ends[i - 1] > start:
+            return True
+        return i < len(self.starts) and self.starts[i] < end
+
+    def add(self, start: int, end: int):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def remove(self, start: int, end: int):
+        i = bisect_left(self.starts, start)
+        del self.starts[i]
+        del self.ends[i]
+
+def sample_slices(pairs: Iterable[Dict], k: int, rng: random.Random,
+                  max_len: int = MAX_SLICE_LEN) -> List[List[Dict]]:
+    """
+    Pick up to k non-overlapping slices of consecutive good pairs in one pass.
+
+    Every position in a run of pairs that passed the quality filter starts one
+    candidate window of random length, fed through reservoir sampling; an
+    interval index rejects candidates that would overlap an already kept slice.
+    pairs may be a stream: only the kept slices and the next max_len pairs
+    are held in memory.
+    """
+    reservoir = []  # (start, end, pairs)
+    index = IntervalIndex()
+    seen = 0
+    run = deque()  # pairs of the current good run from position head on, at most max_len + 1
+    head = 0
+
+    def offer(start: int, end: int):
+        nonlocal seen
+        seen += 1
+        if len(reservoir) < k:
+            if not index.overlaps(start, end):
+                reservoir.append((start, end, list(islice(run, end - start))))
+                index.add(start, end)
+            return
+        r = rng.randrange(seen)
+        if r >= k:
+            return
+        old_start, old_end, _ = reservoir[r]
+        index.remove(old_start, old_end)
+        if index.overlaps(start, end):
+            index.add(old_start, old_end)
         else:
-            i += 1
-    
-    # Return in chronological order
-    return list(reversed(pairs))
-
-def random_slices(lst, k=3):
-    n = len(lst)
-    slices = []
-    for _ in range(k):
-        if n < 2:
-            break  # can't slice meaningfully
-        i, j = sorted(random.sample(range(n + 1), 2))  # choose two cut points
-        if i != j:
-            if j-i > 25:
-                i = j-25
-            slices.append(lst[i:j])
-    return slices
+            reservoir[r] = (start, end, list(islice(run, end - start)))
+            index.add(start, end)
+
+    def offer_head(run_end: int):
+        # one candidate per start, so every start is equally likely to be kept;
+        # stepping by window length would crowd candidates where windows are
+        # forced short at the end of a run. Overlaps are kept apart by the index.
+        nonlocal head
+        offer(head, head + rng.randint(1, min(max_len, run_end - head)))
+        run.popleft()
+        head += 1
+
+    for pos, pair in enumerate(pairs):
+        if pair['bad']:
+            # [head, pos) is the rest of a run of good pairs
+            while run:
+                offer_head(pos)
+            head = pos + 1
+            continue
+        run.append(pair)
+        # the run goes on past head + max_len, so head's window length is known
+        if len(run) > max_len:
+            offer_head(head + len(run))
+    while run:
+        offer_head(head + len(run))
+
+    return [sl for _, _, sl in sorted(reservoir, key=lambda item: item[0])]
 
 def quality_fail(msg: str) -> bool:
     """Soft quality filters: essays, attachment-heavy, spammy junk."""
-    if not msg or not isinstance(msg, str):
-        return True
-    m = msg.strip().lower()
+    return QUALITY_FILTER.fails(msg)
+
+def process_file(file_path: str, examples_per_file: int = 3, seed: Optional[int] = None,
+                 hasher: Optional["MinHasher"] = None) -> Tuple[List[Dict], List[Tuple[int, ...]], Dict[str, Counter]]:
+    """
+    Parse one conversation file. Runs in a worker process.
+
+    Returns its fine-tuning examples, their MinHash band keys if a hasher is
+    given (so the signatures are computed in the worker), and the filter hits
+    it caused, keyed "blacklist" and "quality", since counters in a worker
+    never reach the parent.
+    """
+    rng = random.Random(seed)
+    examples = []
+    # workers are reused across files, so report only what this file added
+    before = {"blacklist": Counter(BLACKLIST_FILTER.hits), "quality": Counter(QUALITY_FILTER.hits)}
+    try:
+        # records flow through parsing, pairing and the quality check into the
+        # sampler, so memory doesn't grow with the size of the file
+        pairs = iter_quality_checked(iter_message_pairs(iter_messages(file_path)))
+        selected = sample_slices(pairs, examples_per_file, rng)
+
+        # format for fine-tuning
+        for sl in selected:
+            msg_list = []
+            for p in sl:
+                msg_list += [
+                    {"role": "user", "content": p['user']},
+                    {"role": "assistant", "content": p['assistant']}
+                ]
+            examples.append({"messages": msg_list})
+
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+
+    keys = [hasher.band_keys(example_text(example)) for example in examples] if hasher else []
+    return examples, keys, {"blacklist": BLACKLIST_FILTER.hits - before["blacklist"],
+                            "quality": QUALITY_FILTER.hits - before["quality"]}
+
+def lsh_bands(threshold: float, num_perm: int) -> int:
+    """Number of bands whose LSH similarity threshold, (1/bands)^(1/rows), is closest to threshold."""
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(divisors, key=lambda b: abs((1 / b) ** (b / num_perm) - threshold))
+
+class MinHasher:
+    """
+    Seeded MinHash signatures cut into LSH band keys.
+
+    Holds only the permutations, so it is cheap to send to worker processes.
+    Each band is reduced to one 64-bit key with the band index mixed in, so
+    equal keys mean the band matched. Hashing is process independent, so
+    keys are reproducible across runs and workers.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, shingle_size: int = 3, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, self._PRIME), rng.randrange(self._PRIME)) for _ in range(num_perm)]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        words = text.lower().split()
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = [zlib.crc32(sh.encode('utf-8')) for sh in shingles]
+        p = self._PRIME
+        return tuple(min((a * h + b) % p for h in hashes) for a, b in self._perms)
+
+    def band_keys(self, text: str) -> Tuple[int, ...]:
+        sig = self.signature(text)
+        rows = self.rows
+        return tuple(
+            int.from_bytes(hashlib.blake2b(struct.pack(f"<H{rows}Q", band, *sig[band * rows:(band + 1) * rows]),
+                                           digest_size=8).digest(), "little")
+            for band in range(self.bands)
+        )
+
+class MinHashDeduper:
+    """
+    Streaming near-duplicate filter using MinHash LSH banding.
+
+    A text is a duplicate if all rows of at least one band of its signature
+    match a kept text. The band shape is picked so that this happens from
+    about `threshold` estimated Jaccard similarity on. Only the band keys of
+    kept texts are remembered, as one set of 64-bit ints, so memory per kept
+    text is a few hundred bytes. Keys can be computed elsewhere with
+    `hasher` and passed to is_duplicate_keys.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: Optional[int] = None,
+                 shingle_size: int = 3, seed: int = 0):
+        """
+        Args:
+            bands: Number of LSH bands, by default picked from threshold
+        """
+        if bands is None:
+            bands = lsh_bands(threshold, num_perm)
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, bands, shingle_size, seed)
+        self._seen: Set[int] = set()
+        self.duplicates = 0
+
+    def is_duplicate(self, text: str) -> bool:
+        """Return True if text near-duplicates a previously kept one, otherwise keep it."""
+        return self.is_duplicate_keys(self.hasher.band_keys(text))
+
+    def is_duplicate_keys(self, keys: Iterable[int]) -> bool:
+        """is_duplicate for band keys from hasher.band_keys."""
+        keys = tuple(keys)
+        if any(key in self._seen for key in keys):
+            self.duplicates += 1
+            return True
+        self._seen.update(keys)
+        return False
+
+def example_text(example: Dict) -> str:
+    return "\n".join(m["content"] for m in example["messages"])
+
+def file_seed(seed: int, file_path: str) -> int:
+    # depends only on the run seed and the file, not on file order or worker
+    return zlib.crc32(file_path.encode('utf-8'), seed & 0xffffffff)
+
+def iter_fine_tuning_dataset(top_files: List[str], examples_per_file: int = 3,
+                             workers: Optional[int] = None, seed: int = 0,
+                             dedupe_threshold: Optional[float] = 0.8) -> Iterator[Dict]:
+    """
+    Yield examples file by file, processing files in parallel across `workers` processes.
+
+    Runs with the same seed produce the same dataset. Examples that near-duplicate
+    an earlier one (MinHash similarity >= dedupe_threshold) are dropped; pass
+    None to keep everything.
+    """
+    seeds = [file_seed(seed, path) for path in top_files]
+    deduper = MinHashDeduper(dedupe_threshold, seed=seed) if dedupe_threshold is not None else None
+
+    def emit(results):
+        hits = {"blacklist": Counter(), "quality": Counter()}
+        for examples, keys, file_hits in results:
+            for name, counts in file_hits.items():
+                hits[name].update(counts)
+            for i, example in enumerate(examples):
+                if deduper and deduper.is_duplicate_keys(keys[i]):
+                    continue
+                yield example
+        print("Blacklist hits:", dict(hits["blacklist"]))
+        print("Quality hits:", dict(hits["quality"]))
+        if deduper:
+            print(f"Dropped {deduper.duplicates} near-duplicate examples")
+
+    n = len(top_files)
+    hashers = [deduper.hasher if deduper else None] * n
+    if workers == 1:
+        yield from emit(map(process_file, top_files, [examples_per_file] * n, seeds, hashers))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from emit(pool.map(process_file, top_files, [examples_per_file] * n, seeds, hashers))
+
+def create_fine_tuning_dataset(top_files: List[str], examples_per_file: int = 3,
+                               workers: Optional[int] = None, seed: int = 0,
+                               dedupe_threshold: Optional[float] = 0.8) -> List[Dict]:
+    return list(iter_fine_tuning_dataset(top_files, examples_per_file, workers, seed, dedupe_threshold))
+
+def write_jsonl_shards(examples: Iterable[Dict], output_file: str,
+                       shard_size: Optional[int] = None, flush_every: int = 1000) -> List[str]:
+    """
+    Write examples to JSONL as they arrive and return the written paths.
+
+    Without shard_size everything goes to output_file; otherwise a new
+    "<name>-00000.jsonl" shard is started every shard_size examples.
+    """
+    base, ext = os.path.splitext(output_file)
+    paths = []
+    f = None
+    count = 0
+    try:
+        for item in examples:
+            if f is None or (shard_size and count % shard_size == 0):
+                if f:
+                    f.close()
+                path = f"{base}-{len(paths):05d}{ext}" if shard_size else output_file
+                f = open(path, 'w', encoding='utf-8')
+                paths.append(path)
+            f.write(json.dumps(item) + '\n')
+            count += 1
+            if count % flush_every == 0:
+                f.flush()
+    finally:
+        if f:
+            f.close()
+    return paths
 
-    # Too long (essay-like)
-    if len(m.split()) > 150 or len(m) > 1000:
-        return True
 
-    # Too many attachments
-    if sum(m.count(ext) for ext in [".jpg", ".jpeg", ".png", ".heic", ".mov"]) > 1:
-        return True
 
-    # Ad / bio spam heuristics
-    if any(tag in m for tag in [
-        "follow me on instagram", "check out this home on airbnb",
-        "likes,", "comments -", "menu offers a variety"
-    ]):
-        return True
-
-    return False
-
-def create_fine_tuning_dataset(top_files: List[str], examples_per_file: int = 3) -> List[Dict]:
-    dataset = []
-
-    for file_path in top_files:
-        try:
-            messages = parse_messages(file_path)
-            pairs = extract_message_pairs(messages)
-
-            # keep trying slices until they pass quality check
-            selected = []
-            attempts = 0
-            while len(selected) < examples_per_file and attempts < 20:
-                slices = random_slices(pairs, k=examples_per_file)
-                for sl in slices:
-                    all_msgs = [p['user'] for p in sl] + [p['assistant'] for p in sl]
-                    if all(not quality_fail(m) for m in all_msgs):
-                        selected.append(sl)
-                attempts += 1
-
-            # fallback: if still empty, allow slices but strip bad msgs
-            if not selected:
-                for sl in random_slices(pairs, k=examples_per_file):
-                    cleaned = []
-                    for p in sl:
-                        if not quality_fail(p['user']) and not quality_fail(p['assistant']):
-                            cleaned.append(p)
-                    if cleaned:
-                        selected.append(cleaned)
-
-            # format for fine-tuning
-            for sl in selected:
-                msg_list = []
-                for p in sl:
-                    msg_list += [
-                        {"role": "user", "content": p['user']},
-                        {"role": "assistant", "content": p['assistant']}
-                    ]
-                dataset.append({"messages": msg_list})
-
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
-
-    return dataset
-
-
-
-def main(n_files: int = 10, examples_per_file: int = 5):
+def main(n_files: int = 10, examples_per_file: int = 5, workers: Optional[int] = None,
+         shard_size: Optional[int] = None, seed: int = 0):
     # Get all text files from output directory
     output_dir = '/Users/minjunes/mafia/output'
     all_files = []
@@ -219,18 +594,21 @@ def main(n_files: int = 10, examples_per_file: int = 5):
     for i, (filepath, size) in enumerate(all_files[:n_files], 1):
         print(f"{i}. {os.path.basename(filepath)} ({size:,} bytes)")
     
-    # Create dataset with specified examples per file
-    dataset = create_fine_tuning_dataset(top_files, examples_per_file=examples_per_file)
-    
-    # Save to JSONL format
+    # Stream examples from the worker pool straight to JSONL
+    n_examples = 0
+    def counted(examples):
+        nonlocal n_examples
+        for item in examples:
+            n_examples += 1
+            yield item
+
+    dataset = iter_fine_tuning_dataset(top_files, examples_per_file=examples_per_file, workers=workers, seed=seed)
     output_file = 'fine_tune_dataset.jsonl'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in dataset:
-            f.write(json.dumps(item) + '\n')
+    paths = write_jsonl_shards(counted(dataset), output_file, shard_size=shard_size)
     
     print(f"\nDataset created successfully!")
-    print(f"Total examples: {len(dataset)}")
-    print(f"Output file: {output_file}")
+    print(f"Total examples: {n_examples}")
+    print(f"Output file(s): {', '.join(paths)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+from typing import Awaitable, Callable, List, Optional
+
+import asyncio
+import heapq
+import math
+import random
+import time
+
+# Only delays observed in the past WINDOW_S seconds are sampled from
+WINDOW_S = 600
+# Max delays remembered per seat position
+WINDOW_SIZE = 256
+# Log-spaced histogram buckets between MIN_DELAY_S and MAX_DELAY_S
+N_BUCKETS = 32
+MIN_DELAY_S = 0.1
+MAX_DELAY_S = 600.0
+# Used while a position has no recent observations
+DEFAULT_DELAY_RANGE_S = (2.0, 10.0)
+
+
+class _DelayRing:
+    """Circular buffer of (time, bucket) observations plus per-bucket counts."""
+
+    def __init__(self, size: int, n_buckets: int):
+        self.times = [0.0] * size
+        self.buckets = [0] * size
+        self.counts = [0] * n_buckets
+        self.head = 0
+        self.size = 0
+
+    def push(self, now: float, bucket: int):
+        capacity = len(self.times)
+        if self.size == capacity:
+            self._pop()
+        i = (self.head + self.size) % capacity
+        self.times[i] = now
+        self.buckets[i] = bucket
+        self.counts[bucket] += 1
+        self.size += 1
+
+    def expire(self, cutoff: float):
+        # Entries are in time order, so expired ones are always at the head
+        while self.size and self.times[self.head] < cutoff:
+            self._pop()
+
+    def random_bucket(self) -> int:
+        i = (self.head + random.randrange(self.size)) % len(self.times)
+        return self.buckets[i]
+
+    def _pop(self):
+        self.counts[self.buckets[self.head]] -= 1
+        self.head = (self.head + 1) % len(self.times)
+        self.size -= 1
+
+
+class JoinDelayHistogram:
+    """
+    Rolling histogram of real players' join delays per seat position.
+
+    Each position keeps at most `window_size` observations from the last
+    `window_s` seconds. Recording and sampling are O(1) (expiry is amortized
+    O(1)): a sample picks a random live observation and returns a value drawn
+    log-uniformly inside its bucket.
+    """
+
+    def __init__(
+        self,
+        positions: int,
+        window_size: int = WINDOW_SIZE,
+        window_s: float = WINDOW_S,
+        n_buckets: int = N_BUCKETS,
+        min_delay_s: float = MIN_DELAY_S,
+        max_delay_s: float = MAX_DELAY_S,
+    ):
+        self.window_s = window_s
+        self.n_buckets = n_buckets
+        self._log_min = math.log(min_delay_s)
+        self._log_step = (math.log(max_delay_s) - self._log_min) / n_buckets
+        self._rings = [_DelayRing(window_size, n_buckets) for _ in range(positions)]
+
+    def _bucket(self, delay: float) -> int:
+        if delay <= 0:
+            return 0
+        b = int((math.log(delay) - self._log_min) / self._log_step)
+        return min(self.n_buckets - 1, max(0, b))
+
+    def record(self, position: int, delay: float, now: Optional[float] = None):
+        """Record that a player took `delay` seconds to join at `position`."""
+        if not 0 <= position < len(self._rings):
+            return
+        now = time.time() if now is None else now
+        ring = self._rings[position]
+        ring.expire(now - self.window_s)
+        ring.push(now, self._bucket(delay))
+
+    def sample(self, position: int, now: Optional[float] = None) -> float:
+        """Sample a join delay for `position` from the recent observations."""
+        now = time.time() if now is None else now
+        if not 0 <= position < len(self._rings):
+            return random.uniform(*DEFAULT_DELAY_RANGE_S)
+        ring = self._rings[position]
+        ring.expire(now - self.window_s)
+        if not ring.size:
+            return random.uniform(*DEFAULT_DELAY_RANGE_S)
+        b = ring.random_bucket()
+        lo = self._log_min + b * self._log_step
+        return math.exp(random.uniform(lo, lo + self._log_step))
+
+    def counts(self, position: int) -> List[int]:
+        """Current per-bucket observation counts for `position`."""
+        return list(self._rings[position].counts)
+
+
+class DelayedJoinScheduler:
+    """
+    Runs delayed callbacks for all lobbies from a single task.
+
+    Pending joins live in one heap ordered by due time, so thousands of
+    waiting lobbies cost one sleeping task instead of one sleep each.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def schedule(self, delay: float, fn: Callable[..., Awaitable], *args):
+        """Run `await fn(*args)` after `delay` seconds. Must be called from the event loop."""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, fn, args))
+        self._seq += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            timeout = self._heap[0][0] - time.monotonic()
+            if timeout > 0:
+                # Wake up early if an earlier join gets scheduled meanwhile
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                await fn(*args)
+            except Exception as e:
+                print(f"Delayed join error: {e}")
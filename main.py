@@ -1,26 +1,48 @@
 
-from fastapi import FastAPI
+from fastapi import FastAPI, APIRouter, Request
 from pydantic import BaseModel
-from fastapi.responses import HTMLResponse
 from fastapi import WebSocket, WebSocketDisconnect
-from username_generator import generate_username
-from typing import Dict, List, Tuple
+from username_generator import UsernameAllocator
+from typing import AsyncIterator, Dict, List, Tuple
 from dataclasses import dataclass
-from ai_client import AIClient
+from contextlib import asynccontextmanager, suppress
+from ai_client import AIClient, MessageData as AIMessageData, MEMORY_S, WINDOW_CHUNK, ReplyRetracted, get_default_router
+from snapshots import LobbySnapshotStore, SNAPSHOT_INTERVAL_S, RESTORE_GRACE_S, COLLECT_CHUNK
+from join_delays import JoinDelayHistogram, DelayedJoinScheduler, WINDOW_S
+from flood_control import FloodGuard, MAX_MERGED_CHARS
+from static_assets import StaticAsset
+from vote_tally import VoteTally
+from collections import Counter
 
 import json
 import sqlite3
 import time
 import asyncio
 import random
+import itertools
+import gc
 
 # run with ./env/bin/uvicorn main:app --reload
+# (or ./env/bin/uvicorn --factory main:create_app)
 MAX_LOBBY = 50
 MAX_PLAYERS = 4
 SILENCE_INTERVAL = 5.0
-app = FastAPI()
-conn = sqlite3.connect("test.db", isolation_level=None, check_same_thread=False)
-cur = conn.cursor()
+# "stable" keeps a cache-friendly prompt prefix across lobbies and turns
+PROMPT_LAYOUT = "stable"
+# pre-generate AI replies while a lobby is quiet (costs extra LLM calls)
+SPECULATIVE_AI = False
+# AI replies are streamed to clients no faster than this typing rate
+# (words per minute, 5 characters per word)
+TYPING_WPM = 80
+# minimum gap between two stream frames for the same message (seconds)
+STREAM_FRAME_INTERVAL = 0.1
+# AI history messages kept in lobby snapshots, enough for a full prompt window
+AI_SNAPSHOT_HISTORY = int(MEMORY_S / SILENCE_INTERVAL) + WINDOW_CHUNK
+# votes cast within this window go out as one vote_count_update (seconds)
+VOTE_FLUSH_S = 0.1
+# websocket close code uvicorn sends to clients when the server shuts down
+SERVICE_RESTART = 1012
+DB_PATH = "test.db"
 
 # TODO
 # - save game to dba and rm from manager when done
@@ -33,28 +55,29 @@ cur = conn.cursor()
 #   - it has to choose when to speak
 #   - is max WPM of ai ~= TPM, keep streaming
 
-# Clean startup for dev - drop existing tables
-cur.execute("DROP TABLE IF EXISTS Lobbies")
-
-cur.execute("CREATE TABLE " \
-"Lobbies(" \
-  "id INTEGER PRIMARY KEY AUTOINCREMENT, " \
-  "status TEXT, " \
-  "players TEXT," \
-  "state TEXT" \
-  ");"
-)
-
-def load_html():
-    try:
-        with open("chat.html", "r") as file:
-            return file.read()
-    except FileNotFoundError:
-        print("Warning: chat.html not found, using fallback HTML")
-        return "<html><body><h1>Error: chat.html not found</h1></body></html>"
-
-# Load HTML at module initialization
-html_content = load_html()
+def open_db(path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    cur = conn.cursor()
+
+    # Clean startup for dev - drop existing tables
+    # (in-progress lobbies survive restarts through the LobbySnapshots table)
+    cur.execute("DROP TABLE IF EXISTS Lobbies")
+
+    cur.execute("CREATE TABLE " \
+    "Lobbies(" \
+      "id INTEGER PRIMARY KEY AUTOINCREMENT, " \
+      "status TEXT, " \
+      "players TEXT," \
+      "state TEXT" \
+      ");"
+    )
+    return conn
+
+def load_index() -> StaticAsset:
+    return StaticAsset.from_file(
+        "chat.html", "text/html; charset=utf-8",
+        fallback=b"<html><body><h1>Error: chat.html not found</h1></body></html>",
+    )
 
 @dataclass 
 class MessageData:
@@ -75,38 +98,289 @@ class LobbyMemory:
     # Voting phase management
     voting_active: bool = False
     voting_timer_task: asyncio.Task = None
-    player_votes: Dict[str, str] = None  # who voted for whom
-    vote_counts: Dict[str, int] = None  # vote count per player
+    tally: VoteTally = None  # ballots and counts of the current voting phase
+    vote_flush_task: asyncio.Task = None  # pending coalesced vote_count_update
 
     # virtual client
     ai_player: str = None  # the actual AI player (randomly chosen)
     ai_client: AIClient = None
+    ai_seat: int = 0  # seat position the AI joins at
+    ai_joined: bool = False
+    ai_paused: bool = False  # restored lobby, the AI waits for the first player to reconnect
+    expiry: asyncio.TimerHandle = None  # drops a restored lobby nobody reconnects to
+
+    # seat bookkeeping for the join delay model
+    joined: int = 0  # seats taken by connected players, AI included
+    last_join_time: float = 0.0
+    last_joiner_ai: bool = False
+    seated: set[str] = None  # players that connected at least once, reconnects don't take a new seat
+    # names this lobby allocated or reserved, the only ones it may release
+    # (ai_player is reassigned when voting starts and player ids come from the URL)
+    names: set[str] = None
+
+    def open_seats(self) -> int:
+        """Seats left once reserved players and a pending AI are counted"""
+        pending_ai = 0 if self.ai_joined else 1
+        return self.max_players - len(self.players) - pending_ai
 
     def __post_init__(self):
         if self.voted_players is None:
             self.voted_players = set()
-        if self.player_votes is None:
-            self.player_votes = {}
-        if self.vote_counts is None:
-            self.vote_counts = {}
+        if self.seated is None:
+            self.seated = set()
+        if self.names is None:
+            self.names = set()
+
+def ordinal(n: int) -> str:
+    if n == 1:
+        return "1st"
+    elif n == 2:
+        return "2nd"
+    elif n == 3:
+        return "3rd"
+    return f"{n}th"
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, conn: sqlite3.Connection):
         self.lobbies: Dict[str, LobbyMemory] = dict()
+        self.stream_ids = itertools.count()
+        # globally unique player and AI names
+        self.usernames = UsernameAllocator()
+        # recent real-player join delays per seat position, drives AI join timing
+        self.join_delays = JoinDelayHistogram(MAX_PLAYERS)
+        self.join_scheduler = DelayedJoinScheduler()
+        # player_id -> time /join_game handed out a brand new lobby
+        self.join_requested_at: Dict[str, float] = dict()
+        self.snapshots = LobbySnapshotStore(conn)
+        self.snapshot_task: asyncio.Task = None
+        self.snapshot_write: asyncio.Future = None  # LobbySnapshotStore.write running in a thread
+        # inbound frames accepted, merged and dropped per reason, across all connections
+        self.flood_stats = Counter()
+        # speculation counters of AI clients whose lobby is gone
+        self.retired_speculation = Counter()
+
+    def lobby_token(self, lobby: LobbyMemory) -> tuple:
+        """Cheap change marker for incremental snapshots (AI silence ticks don't count)"""
+        return (len(lobby.message_history), lobby.ai_client.context_version, lobby.joined,
+                len(lobby.players), lobby.vote_requests, lobby.ai_joined)
+
+    def lobby_state(self, lobby: LobbyMemory) -> dict:
+        """Everything needed to rebuild a lobby after a restart, minus sockets and tasks"""
+        return {
+            "players": list(lobby.players),
+            "seated": list(lobby.seated),
+            # entries are immutable tuples, a shallow copy is enough
+            "message_history": list(lobby.message_history),
+            "vote_requests": lobby.vote_requests,
+            "voted_players": list(lobby.voted_players),
+            "ai_player": lobby.ai_player,
+            "ai_seat": lobby.ai_seat,
+            "ai_joined": lobby.ai_joined,
+            "joined": lobby.joined,
+            # the AI only ever prompts with the tail of its history
+            "ai_history": [[m.type, m.sender, m.message, m.timestamp]
+                           for m in lobby.ai_client.message_history[-AI_SNAPSHOT_HISTORY:]],
+        }
+
+    async def restore_lobby(self, lobby_id: str, state: dict):
+        lobby = LobbyMemory(
+            connections=[],
+            players=set(state["players"]),
+            message_history=[tuple(m) for m in state["message_history"]],
+            vote_requests=state["vote_requests"],
+            voted_players=set(state["voted_players"]),
+            ai_player=state["ai_player"],
+            ai_seat=state["ai_seat"],
+            ai_joined=state["ai_joined"],
+            joined=state["joined"],
+            seated=set(state["seated"]),
+            last_join_time=time.time(),
+        )
+        lobby.ai_client = AIClient(lobby.ai_player, lobby_id, silence_interval=SILENCE_INTERVAL,
+                                   prompt_layout=PROMPT_LAYOUT, speculative=SPECULATIVE_AI)
+        lobby.ai_client.message_history = [AIMessageData(*m) for m in state["ai_history"]]
+        self.lobbies[lobby_id] = lobby
+        for name in {lobby.ai_player, *lobby.players}:
+            if self.usernames.reserve(name):
+                lobby.names.add(name)
+
+        # no LLM calls for a lobby nobody comes back to, see resume_ai
+        lobby.ai_paused = True
+        # expiry only tears down in-memory state, so it runs on the loop rather than
+        # holding up AI seat joins on the join scheduler
+        lobby.expiry = asyncio.get_running_loop().call_later(
+            RESTORE_GRACE_S, self.expire_if_abandoned, lobby_id, lobby)
+        self.snapshots.mark_clean(lobby_id, self.lobby_token(lobby))
+
+    async def restore_lobbies(self) -> int:
+        """Load the last snapshot so players can reconnect into their games after a restart"""
+        # Restoring allocates millions of long-lived objects; collecting while
+        # doing so only rescans them, so pause gc until they are all in place.
+        # (not gc.freeze(): AIClient holds a reference cycle, so frozen lobbies
+        # would never be freed once removed)
+        gc.disable()
+        try:
+            states = await asyncio.to_thread(self.snapshots.load)
+            for lobby_id, state in states.items():
+                await self.restore_lobby(lobby_id, state)
+        finally:
+            gc.enable()
+        return len(states)
+
+    async def resume_ai(self, lobby_id: str, lobby: LobbyMemory):
+        """Start or reschedule a restored lobby's AI once a player is back"""
+        lobby.ai_paused = False
+        if lobby.ai_joined:
+            await lobby.ai_client.start(self.broadcast, self.broadcast_stream)
+        elif lobby.joined >= lobby.ai_seat:
+            self.join_scheduler.schedule(self.join_delays.sample(lobby.ai_seat), self.ai_join, lobby_id, lobby)
+
+    def expire_if_abandoned(self, lobby_id: str, lobby: LobbyMemory):
+        """Drop a restored lobby nobody reconnected to"""
+        if self.lobbies.get(lobby_id) is lobby and not lobby.connections:
+            self.remove_lobby(lobby_id)
+
+    def remove_lobby(self, lobby_id: str):
+        lobby = self.lobbies.pop(lobby_id)
+        for name in lobby.names:
+            self.usernames.release(name)
+        # don't wait out an in-flight LLM call, the lobby is gone either way
+        lobby.ai_client.cancel()
+        self.retired_speculation.update(self.speculation_counts(lobby.ai_client))
+        if lobby.expiry:
+            lobby.expiry.cancel()
+
+    @staticmethod
+    def speculation_counts(ai_client: AIClient) -> dict:
+        return {k: v for k, v in ai_client.speculation_stats().items() if k != "hit_rate"}
+
+    def speculation_stats(self) -> dict:
+        """AIClient.speculation_stats summed over all lobbies, removed ones included"""
+        totals = Counter(self.retired_speculation)
+        for lobby in self.lobbies.values():
+            totals.update(self.speculation_counts(lobby.ai_client))
+        started = totals["started"]
+        return {
+            "started": started,
+            "hits": totals["hits"],
+            "invalidated": totals["invalidated"],
+            "hit_rate": totals["hits"] / started if started else 0.0,
+        }
+
+    async def snapshot(self) -> int:
+        """Write lobbies that changed since the last snapshot. Returns the number written."""
+        # a write keeps running in its thread even if its caller is cancelled,
+        # so never start another on the same connection before it finishes
+        if self.snapshot_write is not None and not self.snapshot_write.done():
+            await asyncio.wait([self.snapshot_write])
+        # Copying state allocates a lot of containers, enough to push gc into a
+        # gen-2 pass over the whole lobby heap (~0.5s at 10k lobbies) that blocks
+        # the loop. The copies are freed by refcount once written, so pause gc
+        # until the write is done, like restore_lobbies.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            items = list(self.lobbies.items())
+            changed = []
+            for i in range(0, len(items), COLLECT_CHUNK):
+                changed += self.snapshots.collect(items[i:i + COLLECT_CHUNK], self.lobby_token, self.lobby_state)
+                # copying state is CPU work on the loop, let sockets run between slices
+                await asyncio.sleep(0)
+            removed = self.snapshots.removed(self.lobbies)
+            self.snapshot_write = asyncio.ensure_future(asyncio.to_thread(self.snapshots.write, changed, removed))
+        except BaseException:
+            if gc_enabled:
+                gc.enable()
+            raise
+        if gc_enabled:
+            # not in a finally: the write goes on if this caller is cancelled
+            self.snapshot_write.add_done_callback(lambda _: gc.enable())
+        return await asyncio.shield(self.snapshot_write)
+
+    async def snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL_S)
+            # also reached when no new join requests come in to prune on
+            self.prune_join_requests(time.time())
+            try:
+                await self.snapshot()
+            except Exception as e:
+                print(f"Snapshot error: {e}")
+
+    def request_join(self, player_id: str):
+        """Remember when a player was sent to a new lobby to measure the first seat's delay"""
+        now = time.time()
+        self.join_requested_at[player_id] = now
+        self.prune_join_requests(now)
+
+    def prune_join_requests(self, now: float):
+        """Forget join requests older than WINDOW_S and free their names"""
+        # dicts keep insertion order, so abandoned requests are at the front
+        for stale in list(itertools.takewhile(lambda p: now - self.join_requested_at[p] > WINDOW_S,
+                                              self.join_requested_at)):
+            del self.join_requested_at[stale]
+            # the name was only held for this request, nobody connected with it
+            self.usernames.release(stale)
     
     async def create_new_lobby_with_ai(self, lobby_id: str):
-        self.lobbies[lobby_id] = LobbyMemory(connections=[], message_history=[], players=set())
-
-        ai_player = generate_username()
-
-        self.lobbies[lobby_id].ai_player = ai_player
-        self.lobbies[lobby_id].players.add(ai_player)
+        lobby = LobbyMemory(connections=[], message_history=[], players=set())
+        self.lobbies[lobby_id] = lobby
+
+        ai_player = self.usernames.allocate()
+        lobby.ai_player = ai_player
+        lobby.names.add(ai_player)
+        lobby.ai_client = AIClient(ai_player, lobby_id, silence_interval=SILENCE_INTERVAL, prompt_layout=PROMPT_LAYOUT,
+                                   speculative=SPECULATIVE_AI)
+
+        # equal chance to take any seat, the AI joins once the seats before it are taken
+        lobby.ai_seat = random.randrange(lobby.max_players)
+        if lobby.ai_seat == 0:
+            await self.ai_join(lobby_id, lobby)
+
+    async def ai_join(self, lobby_id: str, lobby: LobbyMemory):
+        """Seat the AI player and start its client"""
+        # lobby ids are reused, so make sure this is still the same lobby
+        if self.lobbies.get(lobby_id) is not lobby or lobby.ai_joined:
+            return
 
-        ai_client = AIClient(ai_player, lobby_id, silence_interval=SILENCE_INTERVAL)
-        self.lobbies[lobby_id].ai_client = ai_client
+        lobby.ai_joined = True
+        lobby.players.add(lobby.ai_player)
+        lobby.joined += 1
+        lobby.last_join_time = time.time()
+        lobby.last_joiner_ai = True
 
+        # history was collected while waiting, but don't answer every queued message
+        lobby.ai_client.message_queue.clear()
         # start the ai_client
-        await self.lobbies[lobby_id].ai_client.start(self.broadcast)
+        await lobby.ai_client.start(self.broadcast, self.broadcast_stream)
+
+        if lobby.connections:
+            await self.broadcast_player_update(lobby_id, list(lobby.players))
+            await self.broadcast(lobby_id, f"The {ordinal(lobby.joined)} player joined the lobby", player_id="system")
+            if len(lobby.players) >= lobby.max_players:
+                await self.start_sig(lobby_id)
+
+    def record_join(self, lobby: LobbyMemory, player_id: str):
+        """Take the next seat for a real player and feed its delay to the join delay model"""
+        if player_id in lobby.seated:
+            # reconnecting, e.g. after a restart
+            return
+        lobby.seated.add(player_id)
+        now = time.time()
+        seat = lobby.joined
+        requested_at = self.join_requested_at.pop(player_id, None)
+        if requested_at is not None:
+            # /join_game allocated this name for a new lobby, which is this one
+            lobby.names.add(player_id)
+        if seat == 0:
+            if requested_at is not None:
+                self.join_delays.record(seat, now - requested_at, now)
+        elif not lobby.last_joiner_ai:
+            self.join_delays.record(seat, now - lobby.last_join_time, now)
+
+        lobby.joined += 1
+        lobby.last_join_time = now
+        lobby.last_joiner_ai = False
 
     async def connect(self, websocket: WebSocket, lobby_id: str, player_id: str):
         await websocket.accept()
@@ -115,20 +389,38 @@ class ConnectionManager:
         if lobby_id not in self.lobbies:
             await self.create_new_lobby_with_ai(lobby_id)
 
-        self.lobbies[lobby_id].connections.append(websocket)
-        self.lobbies[lobby_id].players.add(player_id)
+        lobby = self.lobbies[lobby_id]
+        lobby.connections.append(websocket)
+        lobby.players.add(player_id)
+        self.record_join(lobby, player_id)
+        if lobby.ai_paused:
+            await self.resume_ai(lobby_id, lobby)
+
+        # the AI's seat is next, join after a delay typical for that seat
+        if not lobby.ai_joined and lobby.joined == lobby.ai_seat:
+            delay = self.join_delays.sample(lobby.ai_seat)
+            self.join_scheduler.schedule(delay, self.ai_join, lobby_id, lobby)
 
         # on first player join, there will always be ai in the game. ids not revealed until end tho
         await self.broadcast_player_update(lobby_id, list(self.lobbies[lobby_id].players))
 
+    def detach(self, websocket: WebSocket, lobby_id: str):
+        """Drop a socket but keep its player and lobby, used when the server shuts down"""
+        if lobby_id in self.lobbies and websocket in self.lobbies[lobby_id].connections:
+            self.lobbies[lobby_id].connections.remove(websocket)
+
     async def disconnect(self, websocket: WebSocket, lobby_id: str, player_id: str):
         if lobby_id in self.lobbies:
             if websocket in self.lobbies[lobby_id].connections:
                 self.lobbies[lobby_id].connections.remove(websocket)
                 if player_id in self.lobbies[lobby_id].players:
                     self.lobbies[lobby_id].players.remove(player_id)
+                    self.lobbies[lobby_id].seated.discard(player_id)
+                    if player_id in self.lobbies[lobby_id].names:
+                        self.lobbies[lobby_id].names.remove(player_id)
+                        self.usernames.release(player_id)
             if not self.lobbies[lobby_id].connections:
-                del self.lobbies[lobby_id]
+                self.remove_lobby(lobby_id)
             else:
                 await self.broadcast_player_update(lobby_id, list(self.lobbies[lobby_id].players))
 
@@ -160,7 +452,12 @@ class ConnectionManager:
         for connection in self.lobbies[lobby_id].connections:
             await connection.send_text(msg_data)
 
-    async def broadcast(self, lobby_id: str, message: str, player_id: str = None):
+    async def broadcast(self, lobby_id: str, message: str, player_id: str = None, extra: dict = None):
+        """
+        Args:
+            extra: Fields added to the frame sent to clients, so a related
+                update rides along instead of needing a frame of its own
+        """
         if lobby_id in self.lobbies:
             # Store message in history with timestamp
             timestamp = int(time.time())
@@ -172,7 +469,8 @@ class ConnectionManager:
                 "type": "message",
                 "sender": sender,
                 "message": message,
-                "timestamp": timestamp
+                "timestamp": timestamp,
+                **(extra or {})
             })
             
             # Broadcast to all connections
@@ -190,6 +488,68 @@ class ConnectionManager:
             if player_id != self.lobbies[lobby_id].ai_player:
                 await self.lobbies[lobby_id].ai_client.add_message_data(msg_data_obj)
     
+    async def broadcast_stream(self, lobby_id: str, deltas: AsyncIterator[str], player_id: str = None):
+        """
+        Stream a message to the lobby as "message_stream" frames, paced to TYPING_WPM.
+
+        Every frame carries the stream_id and the text added since the previous
+        frame; the last one has done=True and the full message. Deltas arriving
+        faster than the typing rate are held back, so LLM latency is hidden inside
+        the typing delay instead of adding to it. If deltas raises ReplyRetracted,
+        the last frame has retracted=True and an empty message instead.
+        """
+        stream_id = next(self.stream_ids)
+        timestamp = int(time.time())
+        sender = player_id or "system"
+        chars_per_s = TYPING_WPM * 5 / 60
+
+        async def send(delta: str, done: bool, message: str = None, **extra):
+            if lobby_id not in self.lobbies:
+                return
+            frame = {
+                "type": "message_stream",
+                "stream_id": stream_id,
+                "sender": sender,
+                "timestamp": timestamp,
+                "delta": delta,
+                "done": done,
+                **extra,
+            }
+            if done:
+                frame["message"] = message
+            msg_data = json.dumps(frame)
+            for connection in self.lobbies[lobby_id].connections:
+                await connection.send_text(msg_data)
+
+        text = ""
+        pending = ""
+        start = time.monotonic()
+        try:
+            async for delta in deltas:
+                pending += delta
+                while pending and lobby_id in self.lobbies:
+                    # Release as many characters as a human could have typed by now
+                    allowed = int((time.monotonic() - start) * chars_per_s) - len(text)
+                    if allowed <= 0:
+                        await asyncio.sleep(STREAM_FRAME_INTERVAL)
+                        continue
+                    piece, pending = pending[:allowed], pending[allowed:]
+                    text += piece
+                    await send(piece, False)
+                    await asyncio.sleep(STREAM_FRAME_INTERVAL)
+        except ReplyRetracted:
+            # the AI fell silent after all, take back whatever was already shown
+            if text:
+                await send("", True, "", retracted=True)
+            return
+        text += pending
+
+        if lobby_id in self.lobbies and text:
+            # Filed when complete, after anything broadcast while it was typing,
+            # so history stays in time order
+            await send("", True, text)
+            self.lobbies[lobby_id].message_history.append((sender, text, int(time.time())))
+
     async def broadcast_player_update(self, lobby_id: str, players: List[str]):
         """Broadcast updated player list to all clients in the lobby"""
         if lobby_id in self.lobbies:
@@ -204,18 +564,6 @@ class ConnectionManager:
             for connection in self.lobbies[lobby_id].connections:
                 await connection.send_text(msg_data)
 
-    async def broadcast_vote_update(self, lobby_id: str, vote_count: int):
-        """Broadcast updated vote count to all clients in the lobby"""
-        if lobby_id in self.lobbies:
-            msg_data = json.dumps({
-                "type": "vote_update",
-                "votes": vote_count
-            })
-
-            # Broadcast to all connections
-            for connection in self.lobbies[lobby_id].connections:
-                await connection.send_text(msg_data)
-    
     async def start_voting_phase(self, lobby_id: str):
         """Start the voting phase with timer"""
         if lobby_id not in self.lobbies:
@@ -223,10 +571,10 @@ class ConnectionManager:
         
         lobby = self.lobbies[lobby_id]
         lobby.voting_active = True
-        # Initialize vote counts for all players
-        lobby.vote_counts = {player: 0 for player in lobby.players}
         # Randomly select the AI player
         lobby.ai_player = random.choice(list(lobby.players))
+        # Every player starts at 0 votes, the AI wins ties
+        lobby.tally = VoteTally(lobby.players, favored=lobby.ai_player)
         
         # Broadcast voting phase start
         msg_data = json.dumps({
@@ -242,33 +590,28 @@ class ConnectionManager:
     
     async def voting_timer(self, lobby_id: str):
         """Handle the voting phase timer and reveal"""
+        # the phase this timer belongs to; a new one may start during the reveal delay
+        lobby = self.lobbies[lobby_id]
+        tally = lobby.tally
+        ai_player = lobby.ai_player
+
         # 10 second voting phase
         await asyncio.sleep(10)
         
-        if lobby_id not in self.lobbies:
+        if self.lobbies.get(lobby_id) is not lobby:
             return
         
-        lobby = self.lobbies[lobby_id]
         lobby.voting_active = False
+        # the end frame carries the full counts, a pending delta is redundant
+        if lobby.vote_flush_task:
+            lobby.vote_flush_task.cancel()
+            lobby.vote_flush_task = None
         
-        # Find the player with most votes
-        most_voted = None
-        if lobby.vote_counts:
-            max_votes = max(lobby.vote_counts.values())
-            tied_players = [p for p, v in lobby.vote_counts.items() if v == max_votes]
-            
-            # Special case: if AI is tied, AI wins
-            if lobby.ai_player in tied_players:
-                most_voted = lobby.ai_player
-            else:
-                # Otherwise, pick first player with max votes
-                most_voted = tied_players[0] if tied_players else None
-        
-        # Broadcast voting end and most voted player
+        # Broadcast voting end and most voted player (the AI wins ties)
         msg_data = json.dumps({
             "type": "voting_phase_end",
-            "most_voted": most_voted,
-            "vote_counts": lobby.vote_counts
+            "most_voted": tally.leader,
+            "vote_counts": tally.counts
         })
         for connection in lobby.connections:
             await connection.send_text(msg_data)
@@ -279,16 +622,16 @@ class ConnectionManager:
         # Reveal the actual AI
         msg_data = json.dumps({
             "type": "ai_reveal",
-            "ai_player": lobby.ai_player
+            "ai_player": ai_player
         })
         for connection in lobby.connections:
             await connection.send_text(msg_data)
         
-        # Reset voting state
-        lobby.vote_requests = 0
-        lobby.voted_players = set()
-        lobby.player_votes = {}
-        lobby.vote_counts = {}
+        # Reset voting state, unless a newer phase already owns it
+        if lobby.tally is tally:
+            lobby.vote_requests = 0
+            lobby.voted_players = set()
+            lobby.tally = None
     
     async def cast_vote(self, lobby_id: str, voter: str, target: str):
         """Handle a player casting a vote"""
@@ -296,23 +639,31 @@ class ConnectionManager:
             return
         
         lobby = self.lobbies[lobby_id]
-        if not lobby.voting_active or voter not in lobby.players or target not in lobby.players:
+        if not lobby.voting_active or lobby.tally is None:
+            return
+        if voter not in lobby.players or target not in lobby.players:
             return
         
-        # Check if voter already voted
-        if voter in lobby.player_votes:
-            old_target = lobby.player_votes[voter]
-            if old_target in lobby.vote_counts:
-                lobby.vote_counts[old_target] -= 1
-        
-        # Record the vote
-        lobby.player_votes[voter] = target
-        lobby.vote_counts[target] = lobby.vote_counts.get(target, 0) + 1
+        # Re-votes move the ballot, unchanged votes cost nothing
+        if not lobby.tally.vote(voter, target):
+            return
         
-        # Broadcast updated vote counts
+        # Votes inside one window go out together as a single delta frame
+        if lobby.vote_flush_task is None:
+            lobby.vote_flush_task = asyncio.create_task(self.flush_votes(lobby_id, lobby))
+
+    async def flush_votes(self, lobby_id: str, lobby: LobbyMemory):
+        """Broadcast the vote counts that changed during the last VOTE_FLUSH_S"""
+        await asyncio.sleep(VOTE_FLUSH_S)
+        lobby.vote_flush_task = None
+        if not lobby.voting_active or lobby.tally is None or self.lobbies.get(lobby_id) is not lobby:
+            return
+        changes = lobby.tally.take_changes()
+        if not changes:
+            return
         msg_data = json.dumps({
             "type": "vote_count_update",
-            "vote_counts": lobby.vote_counts
+            "vote_counts": changes
         })
         for connection in lobby.connections:
             await connection.send_text(msg_data)
@@ -320,14 +671,57 @@ class ConnectionManager:
 class User(BaseModel):
   username: str
 
-manager = ConnectionManager()
+routes = APIRouter()
 
-@app.get("/")
-def get():
-    return HTMLResponse(html_content)
+@routes.get("/")
+async def get(request: Request):
+    return request.app.state.index.response(
+        request.headers.get("accept-encoding", ""),
+        request.headers.get("if-none-match", ""),
+    )
   
-@app.websocket("/ws/{lobby_id}/{player_id}")
+@routes.get("/flood_stats")
+def flood_stats(request: Request):
+    return dict(request.app.state.manager.flood_stats)
+
+@routes.get("/speculation_stats")
+def speculation_stats(request: Request):
+    return request.app.state.manager.speculation_stats()
+
+@routes.get("/model_stats")
+def model_stats():
+    return get_default_router().stats()
+
+def parse_frame(data: str) -> Tuple[str, str, dict]:
+    """Returns (raw frame, message type, message dict); non-JSON frames are chat messages"""
+    try:
+        msg_data = json.loads(data)
+    except json.JSONDecodeError:
+        return data, 'message', {}
+    if not isinstance(msg_data, dict):
+        return data, 'message', {}
+    return data, msg_data.get('type'), msg_data
+
+async def read_frames(websocket: WebSocket, guard: FloodGuard, frames: asyncio.Queue):
+    """
+    Receive frames into `frames`, dropping oversized and over-rate ones before parsing.
+    A disconnect (or any receive error) is put on the queue for the handler to raise.
+    """
+    try:
+        while True:
+            data = await websocket.receive_text()
+            if guard.admit(data, frames.qsize()):
+                frames.put_nowait(parse_frame(data))
+            elif guard.should_warn():
+                await websocket.send_text(
+                    json.dumps({"type": "system", "message": "You are sending messages too fast, some were dropped."})
+                )
+    except Exception as e:
+        frames.put_nowait(e)
+
+@routes.websocket("/ws/{lobby_id}/{player_id}")
 async def websocket_endpoint(websocket: WebSocket, lobby_id: str, player_id: str):
+    manager: ConnectionManager = websocket.app.state.manager
     print(lobby_id)
     await manager.connect(websocket, lobby_id, player_id)
     
@@ -338,16 +732,13 @@ async def websocket_endpoint(websocket: WebSocket, lobby_id: str, player_id: str
     n_players =  len(manager.lobbies[lobby_id].players)
     
     # Announce that this player has joined
-    if n_players == 1:
-        ordinal = "1st"
-    elif n_players == 2:
-        ordinal = "2nd"
-    elif n_players == 3:
-        ordinal = "3rd"
-    else:
-        ordinal = f"{n_players}th"
-    await manager.broadcast(lobby_id, f"The {ordinal} player joined the lobby", player_id="system")
+    await manager.broadcast(lobby_id, f"The {ordinal(n_players)} player joined the lobby", player_id="system")
     
+    # admitted frames, parsed, waiting to be handled
+    frames = asyncio.Queue()
+    guard = FloodGuard(manager.flood_stats)
+    reader = asyncio.create_task(read_frames(websocket, guard, frames))
+    held = None
     try:
         while True:
             # want to send <silent> token to the ai every x seconds 
@@ -355,15 +746,11 @@ async def websocket_endpoint(websocket: WebSocket, lobby_id: str, player_id: str
             # then we should treat it as a data packet and proceed with
             # execution logic below. 
             # what if we open a seperate websocket just for the AI on the server side? 
-            data = await websocket.receive_text()
-
-            # Parse the incoming message
-            try:
-                msg_data = json.loads(data)
-                msg_type = msg_data.get('type')
-            except json.JSONDecodeError:
-                # If not JSON, treat as regular message
-                msg_type = 'message'
+            frame = held or await frames.get()
+            held = None
+            if isinstance(frame, Exception):
+                raise frame
+            data, msg_type, msg_data = frame
 
             if msg_type == 'vote_request':
                 # Handle vote request
@@ -380,9 +767,9 @@ async def websocket_endpoint(websocket: WebSocket, lobby_id: str, player_id: str
                     lobby.voted_players.add(player_id)
                     lobby.vote_requests += 1
                     vote_count = lobby.vote_requests
-                    # Broadcast vote request notification to all players
-                    await manager.broadcast(lobby_id, f"{player_id} requested a vote", player_id="system")
-                    await manager.broadcast_vote_update(lobby_id, vote_count)
+                    # Broadcast vote request notification and the new count in one frame
+                    await manager.broadcast(lobby_id, f"{player_id} requested a vote", player_id="system",
+                                            extra={"votes": vote_count})
                     
                     # Start voting phase if we have 2+ vote requests
                     if vote_count >= 2 and not lobby.voting_active:
@@ -399,37 +786,59 @@ async def websocket_endpoint(websocket: WebSocket, lobby_id: str, player_id: str
                 # AICLIENT - check if 3. kills self.task in AiClient
                 pass
             else:
+                # fold chat frames that queued up behind this one into a single broadcast
+                parts = [str(msg_data.get('content', data))]
+                size = len(parts[0])
+                while not frames.empty():
+                    held = frames.get_nowait()
+                    if isinstance(held, Exception) or held[1] not in (None, 'message'):
+                        break
+                    content = str(held[2].get('content', held[0]))
+                    if size + len(content) + 1 > MAX_MERGED_CHARS:
+                        break
+                    parts.append(content)
+                    size += len(content) + 1
+                    held = None
+                guard.merged(len(parts) - 1)
                 # broadcast message from this player to all in the lobby
-                message_content = msg_data.get('content', data)
-                await manager.broadcast(lobby_id, message_content, player_id=player_id)
+                await manager.broadcast(lobby_id, "\n".join(parts), player_id=player_id)
+
+    except WebSocketDisconnect as e:
+        if e.code == SERVICE_RESTART:
+            # server is restarting, keep the lobby so the player can reconnect into it
+            manager.detach(websocket, lobby_id)
+            return
 
-    except WebSocketDisconnect:
         # Disconnect from manager
         await manager.disconnect(websocket, lobby_id, player_id)
         
         # Notify remaining players about disconnection
         await manager.broadcast(lobby_id, f"{player_id} left the lobby", player_id="system")
+    finally:
+        reader.cancel()
 
 # user join new game and enters matchmaking queue
 # oauth is a pain but should be figured out later
 # for now assume all users use the same username always
-@app.post("/join_game")
-async def join_game():
-    username = generate_username()
+@routes.post("/join_game")
+async def join_game(request: Request):
+    manager: ConnectionManager = request.app.state.manager
+    username = manager.usernames.allocate()
     # fetch history if exists
     try:
         chosen_lobby = None
         for id in manager.lobbies:
-            if len(manager.lobbies[id].players) < 4:
-                chosen_lobby = (id, manager.lobbies[id].players)
+            # a pending AI keeps its seat reserved
+            if manager.lobbies[id].open_seats() > 0:
+                chosen_lobby = (id, manager.lobbies[id])
                 break
 
         if chosen_lobby:
-            lobby_id, lobby_players = chosen_lobby
-            # loop to generate unique username
-            while username in lobby_players:
-                username = generate_username()
+            lobby_id, lobby = chosen_lobby
+            lobby_players = lobby.players
+            # usernames are globally unique, no need to check the lobby
             lobby_players.add(username)
+            lobby.names.add(username)
             if len(lobby_players) == 4:
                 # braodcast new game start signal
                 await manager.start_sig(lobby_id)
@@ -437,11 +846,49 @@ async def join_game():
         else:
             lobby_id = str(len(manager.lobbies))
             players_str = username
+            manager.request_join(username)
 
         return {"status": "ok", "lobby_id": lobby_id, "player_id": username, "players": players_str}
     except Exception as e:
         raise e
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # everything with a cost (database, lobby restore) happens here, not at import
+    conn = open_db(app.state.db_path)
+    # compressed variants and ETags are built once here, not per request
+    app.state.index = load_index()
+    manager = app.state.manager = ConnectionManager(conn)
+    start = time.perf_counter()
+    n = await manager.restore_lobbies()
+    print(f"Restored {n} lobbies in {time.perf_counter() - start:.3f}s")
+    manager.snapshot_task = asyncio.create_task(manager.snapshot_loop())
+    try:
+        yield
+    finally:
+        manager.snapshot_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await manager.snapshot_task
+        # waits for a write the cancelled loop left running
+        await manager.snapshot()
+        await manager.join_scheduler.stop()
+        conn.close()
+
+def create_app(db_path: str = DB_PATH) -> FastAPI:
+    """
+    Build the app. Nothing is opened or loaded until the lifespan starts, so
+    importing this module and calling create_app() is cheap.
+
+    Args:
+        db_path: SQLite database for lobbies and snapshots (":memory:" in tests)
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.db_path = db_path
+    app.include_router(routes)
+    return app
+
+app = create_app()
+
 # trigger a database write event only when game ends 
 
 # pass each time token into a Wen module
@@ -0,0 +1,375 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import asyncio
+import math
+import threading
+import time
+
+# Latency budget of a single model request (seconds)
+MODEL_BUDGET_S = 8.0
+# Latency budget of a whole decision, hedges and failovers included (seconds)
+DECISION_BUDGET_S = 10.0
+# Hedge after this long while a model has too few samples for a p95 (seconds)
+DEFAULT_HEDGE_AFTER_S = 3.0
+# Samples needed before a model's own p95 is used as its hedge delay
+HEDGE_MIN_SAMPLES = 20
+# Latency samples remembered per model
+LATENCY_WINDOW = 200
+
+
+@dataclass
+class ModelRoute:
+    model: str
+    budget_s: float = MODEL_BUDGET_S
+
+
+class ModelStats:
+    """Rolling latency window and outcome counters for one model."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None
+        self.requests = 0
+        self.wins = 0  # answers that were used
+        self.errors = 0
+        self.timeouts = 0
+        self.invalid = 0
+        self.cancelled = 0  # lost a hedge race
+        self.hedges = 0  # started as a hedge of a slower model
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+        self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.latencies)
+        return self._sorted[min(len(self._sorted) - 1, math.ceil(q * len(self._sorted)) - 1)]
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "wins": self.wins,
+            "hedges": self.hedges,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "invalid": self.invalid,
+            "cancelled": self.cancelled,
+            "p50_s": self.percentile(0.5),
+            "p95_s": self.percentile(0.95),
+        }
+
+
+class OpenAIBackend:
+    """
+    Chat completions through an OpenAI-compatible client (OpenRouter or a local stub server).
+
+    Args:
+        client_factory: Builds the client on first request, so constructing a
+            backend costs nothing until a model is actually called
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], max_tokens: int = 100, temperature: float = 0.7):
+        self.client_factory = client_factory
+        self._client = None
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    async def complete(self, model: str, messages: List[dict], timeout: Optional[float] = None) -> str:
+        # Offload blocking HTTP call to a background thread so we don't block the event loop.
+        # Cancelling the awaiting task can't stop that thread, only the client timeout can.
+        response = await asyncio.to_thread(
+            self.client.chat.completions.create,
+            model=model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            timeout=timeout,
+        )
+        return response.choices[0].message.content.strip()
+
+    async def stream(self, model: str, messages: List[dict], timeout: Optional[float] = None) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        pieces: asyncio.Queue = asyncio.Queue()
+        # set once the consumer is gone, so the worker stops reading and frees its thread
+        closed = threading.Event()
+
+        def run():
+            # The sync client blocks per chunk, so read the stream in a worker thread
+            try:
+                stream = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    stream=True,
+                    timeout=timeout,
+                )
+                try:
+                    for chunk in stream:
+                        if closed.is_set():
+                            break
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            loop.call_soon_threadsafe(pieces.put_nowait, chunk.choices[0].delta.content)
+                finally:
+                    stream.close()
+            except Exception as e:
+                if not closed.is_set():
+                    loop.call_soon_threadsafe(pieces.put_nowait, e)
+            finally:
+                if not closed.is_set():
+                    loop.call_soon_threadsafe(pieces.put_nowait, None)
+
+        worker = asyncio.create_task(asyncio.to_thread(run))
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    break
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+            await worker
+        finally:
+            closed.set()
+
+
+class StubBackend:
+    """
+    In-process backend for tests and benchmarks.
+
+    Args:
+        replies: model -> async or sync fn(messages) returning the raw output,
+            e.g. one that sleeps to simulate latency or raises to simulate errors
+    """
+
+    def __init__(self, replies: Dict[str, Callable[[List[dict]], Awaitable[str]]]):
+        self.replies = replies
+
+    async def complete(self, model: str, messages: List[dict], timeout: Optional[float] = None) -> str:
+        result = self.replies[model](messages)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def stream(self, model: str, messages: List[dict], timeout: Optional[float] = None) -> AsyncIterator[str]:
+        text = await self.complete(model, messages)
+        for i, word in enumerate(text.split(" ")):
+            yield word if i == 0 else " " + word
+
+
+def _log_error(model: str, e: Exception):
+    # Provide clearer hint for common 401 misconfiguration with OpenRouter
+    err_text = str(e)
+    if "401" in err_text or "User not found" in err_text:
+        print(
+            "AI processing error: 401 User not found. Check OPENROUTER_API_KEY and required headers (HTTP-Referer, X-Title)."
+        )
+    else:
+        print(f"AI processing error ({model}): {e}")
+
+
+def parse_routes(spec: str) -> List[ModelRoute]:
+    """Parse "model[:budget_s],model[:budget_s],..." into routes, primary first."""
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, budget = item.rpartition(":")
+        try:
+            routes.append(ModelRoute(model, float(budget)))
+        except ValueError:
+            # no budget given (model ids may contain ':' themselves, e.g. ":free")
+            routes.append(ModelRoute(item))
+    return routes
+
+
+def _valid(text: Optional[str]) -> bool:
+    return bool(text and text.strip())
+
+
+class ModelRouter:
+    """
+    Routes one LLM decision over an ordered list of models.
+
+    The first model is the primary. If it hasn't answered by its own p95
+    latency, the same request is sent to the fastest remaining model (by
+    median latency) and the first valid answer wins; the other request is
+    cancelled. If a model fails or times out, the next one in list order is
+    tried. Whatever is still running when decision_budget_s runs out is
+    cancelled and the decision is None, which callers treat as silence.
+    """
+
+    def __init__(self, routes: List[ModelRoute], backend, decision_budget_s: float = DECISION_BUDGET_S,
+                 default_hedge_after_s: float = DEFAULT_HEDGE_AFTER_S, hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+                 validate: Callable[[Optional[str]], bool] = _valid):
+        """
+        Args:
+            routes: Models in order of preference, primary first
+            backend: Object with async complete(model, messages, timeout) and stream(model, messages, timeout)
+            decision_budget_s: Latency budget of a whole decision
+            default_hedge_after_s: Hedge delay until the primary has hedge_min_samples samples
+            validate: Whether a raw model output is usable
+        """
+        if not routes:
+            raise ValueError("ModelRouter needs at least one route")
+        self.routes = list(routes)
+        self.backend = backend
+        self.decision_budget_s = decision_budget_s
+        self.default_hedge_after_s = default_hedge_after_s
+        self.hedge_min_samples = hedge_min_samples
+        self.validate = validate
+        self.model_stats: Dict[str, ModelStats] = {r.model: ModelStats() for r in self.routes}
+        self.decisions = 0
+        self.silenced = 0  # decisions that ran out of models or budget
+
+    def hedge_after(self, route: ModelRoute) -> float:
+        stats = self.model_stats[route.model]
+        if len(stats.latencies) < self.hedge_min_samples:
+            return min(self.default_hedge_after_s, route.budget_s)
+        return stats.percentile(0.95)
+
+    def _fastest(self, candidates: List[ModelRoute]) -> ModelRoute:
+        # models without samples rank by their budget, ties keep list order
+        def median(r: ModelRoute) -> float:
+            p50 = self.model_stats[r.model].percentile(0.5)
+            return r.budget_s if p50 is None else p50
+        return min(candidates, key=median)
+
+    async def _attempt(self, route: ModelRoute, messages: List[dict]) -> Optional[str]:
+        stats = self.model_stats[route.model]
+        stats.requests += 1
+        start = time.monotonic()
+        try:
+            text = await asyncio.wait_for(self.backend.complete(route.model, messages, timeout=route.budget_s),
+                                          route.budget_s)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            # a timeout is at least this slow, keep it in the window so p95 stays honest
+            stats.record(route.budget_s)
+            return None
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            stats.record(time.monotonic() - start)
+            raise
+        except Exception as e:
+            stats.errors += 1
+            _log_error(route.model, e)
+            return None
+        stats.record(time.monotonic() - start)
+        if not self.validate(text):
+            stats.invalid += 1
+            return None
+        return text
+
+    async def complete(self, messages: List[dict]) -> Optional[str]:
+        """Return the first valid answer within the decision budget, or None."""
+        self.decisions += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.decision_budget_s
+        remaining = list(self.routes)
+        running: Dict[asyncio.Task, ModelRoute] = {}
+
+        def launch(route: ModelRoute) -> float:
+            remaining.remove(route)
+            running[asyncio.create_task(self._attempt(route, messages))] = route
+            return loop.time() + self.hedge_after(route)
+
+        hedge_at = launch(remaining[0])
+        try:
+            while running:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                timeout = deadline - now
+                hedging = remaining and len(running) == 1
+                if hedging:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    route = running.pop(task)
+                    text = task.result()
+                    if text is not None:
+                        self.model_stats[route.model].wins += 1
+                        return text
+                if not remaining:
+                    continue
+                if done:
+                    # failover in preference order, also while a slower request
+                    # is still running, so a failure never looks like a due hedge
+                    hedge_at = launch(remaining[0])
+                elif hedging and loop.time() >= hedge_at:
+                    route = self._fastest(remaining)
+                    self.model_stats[route.model].hedges += 1
+                    hedge_at = launch(route)
+            self.silenced += 1
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        """
+        Stream from the first model that produces a delta within its budget.
+
+        Streams are not hedged: a model that errors or times out before its
+        first delta is skipped for the next one in list order. Once a delta
+        has been yielded the stream is committed to that model.
+        """
+        self.decisions += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.decision_budget_s
+        for route in self.routes:
+            budget = min(route.budget_s, deadline - loop.time())
+            if budget <= 0:
+                break
+            stats = self.model_stats[route.model]
+            stats.requests += 1
+            deltas = self.backend.stream(route.model, messages, timeout=budget)
+            start = time.monotonic()
+            try:
+                first = await asyncio.wait_for(anext(deltas, None), budget)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                stats.record(budget)
+                await deltas.aclose()
+                continue
+            except Exception as e:
+                stats.errors += 1
+                _log_error(route.model, e)
+                await deltas.aclose()
+                continue
+            if first is None:
+                stats.invalid += 1
+                continue
+            stats.wins += 1
+            try:
+                yield first
+                async for piece in deltas:
+                    yield piece
+            except Exception as e:
+                stats.errors += 1
+                _log_error(route.model, e)
+            finally:
+                stats.record(time.monotonic() - start)
+                await deltas.aclose()
+            return
+        self.silenced += 1
+
+    def stats(self) -> dict:
+        return {
+            "decisions": self.decisions,
+            "silenced": self.silenced,
+            "models": {model: s.as_dict() for model, s in self.model_stats.items()},
+        }
@@ -0,0 +1,255 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field, asdict
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ai_client import AIClient, MessageData, PROMPT_LAYOUTS
+# defaults follow the live server, so a replay evaluates what production runs
+from main import PROMPT_LAYOUT, SILENCE_INTERVAL
+from vote_tally import VoteTally
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+
+# run with python replay.py transcripts/*.json --workers 8
+#
+# Replays recorded lobbies through AIClient on a virtual clock, as fast as the
+# process_fn allows, to evaluate prompt and gating changes offline.
+#
+# Transcript format (JSON):
+#   {
+#     "ai_player": "calm-owl12",               # seat the AI under test plays
+#     "messages": [[sender, message, timestamp], ...],   # or {"sender", "message", "timestamp"} dicts
+#     "votes": {"voter": "target", ...}        # optional recorded detection votes
+#   }
+# Messages originally sent by ai_player are dropped and replaced by whatever the
+# AI under test says. Human messages are replayed as recorded, so later human
+# turns don't react to the new AI's messages.
+
+# Virtual seconds to keep running after the last recorded message
+TAIL_S = 30.0
+# Virtual seconds each process_fn call takes, e.g. a typical LLM round-trip
+DECISION_LATENCY_S = 0.0
+
+ProcessFn = Callable[[AIClient], Awaitable[Optional[str]]]
+VoteFn = Callable[[dict, List[tuple]], Dict[str, str]]
+
+
+class VirtualClock:
+    def __init__(self, start: float = 0.0):
+        self.t = start
+
+    def now(self) -> float:
+        return self.t
+
+
+@dataclass
+class ReplayResult:
+    transcript: str
+    decisions: int = 0  # process_fn calls
+    ai_messages: int = 0
+    human_messages: int = 0
+    # virtual seconds between the latest human message and each AI message
+    reaction_times: List[float] = field(default_factory=list)
+    most_voted: Optional[str] = None
+    detected: Optional[bool] = None
+    error: Optional[str] = None
+
+    @property
+    def speak_rate(self) -> float:
+        return self.ai_messages / self.decisions if self.decisions else 0.0
+
+
+def load_transcript(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        transcript = json.load(f)
+    messages = []
+    for m in transcript.get("messages", []):
+        if isinstance(m, dict):
+            messages.append((m["sender"], m["message"], m["timestamp"]))
+        else:
+            sender, message, timestamp = m
+            messages.append((sender, message, timestamp))
+    messages.sort(key=lambda m: m[2])
+    transcript["messages"] = messages
+    return transcript
+
+
+def recorded_votes(transcript: dict, history: List[tuple]) -> Dict[str, str]:
+    """Default vote_fn: the votes stored with the transcript."""
+    return transcript.get("votes") or {}
+
+
+async def always_silent(client: AIClient) -> Optional[str]:
+    """Baseline process_fn that never speaks, useful to time the engine itself."""
+    return None
+
+
+async def replay_transcript(
+    transcript: dict,
+    name: str = "",
+    process_fn: Optional[ProcessFn] = None,
+    vote_fn: VoteFn = recorded_votes,
+    silence_interval: float = SILENCE_INTERVAL,
+    prompt_layout: str = PROMPT_LAYOUT,
+    tail_s: float = TAIL_S,
+    decision_latency_s: float = DECISION_LATENCY_S,
+    **client_kwargs,
+) -> ReplayResult:
+    """
+    Feed one transcript through an AIClient on a virtual clock.
+
+    Time jumps straight to the next recorded message or silence tick, and the
+    client's queue is drained at each point, so a replay takes as long as its
+    process_fn calls and nothing more. Each call advances the clock by
+    decision_latency_s to model the live round-trip.
+    """
+    result = ReplayResult(transcript=name)
+    ai_player = transcript["ai_player"]
+    events = [m for m in transcript["messages"] if m[0] != ai_player]
+    if not events:
+        return result
+
+    clock = VirtualClock(events[0][2])
+    client = AIClient(ai_player, name or "replay", silence_interval=silence_interval, clock=clock.now,
+                      prompt_layout=prompt_layout, **client_kwargs)
+    if process_fn is not None:
+        client.process_fn = partial(process_fn, client)
+
+    # wrap process_fn to count decisions and charge their virtual latency
+    inner_fn = client.process_fn
+
+    async def counted_process_fn():
+        result.decisions += 1
+        response = await inner_fn()
+        clock.t += decision_latency_s
+        return response
+    client.process_fn = counted_process_fn
+
+    history: List[tuple] = []
+    last_human_time = clock.now()
+
+    # Same semantics as ConnectionManager.broadcast for the AI's own messages:
+    # they go into lobby history but are not fed back to the client's queue
+    async def broadcast(lobby_id: str, message: str, player_id: str = None):
+        history.append((player_id or "system", message, int(clock.now())))
+        result.ai_messages += 1
+        result.reaction_times.append(clock.now() - last_human_time)
+
+    end = events[-1][2] + tail_s
+    client.last_silence_time = clock.now()
+    i = 0
+    while True:
+        # nudge past the tick so float rounding can't leave it just short of due
+        next_silence = client.last_silence_time + silence_interval + 1e-9
+        next_event = events[i][2] if i < len(events) else None
+        if next_event is None and next_silence > end:
+            break
+        target = next_silence if next_event is None else min(next_event, next_silence)
+        clock.t = max(clock.t, target)
+
+        while i < len(events) and events[i][2] <= clock.t:
+            sender, message, timestamp = events[i]
+            history.append((sender, message, timestamp))
+            if sender != "system":
+                result.human_messages += 1
+                last_human_time = timestamp
+            await client.add_message_data(MessageData(
+                type="message",
+                sender=sender,
+                message=message,
+                timestamp=timestamp
+            ))
+            i += 1
+
+        # Drain only what is queued now. A step whose decision latency covers a
+        # silence interval queues the next tick itself, so draining until empty
+        # would never end; later ticks are picked up by the next iteration.
+        for _ in range(max(1, len(client.message_queue))):
+            await client.step(broadcast)
+
+    votes = vote_fn(transcript, history)
+    if votes:
+        # same rule as the live voting phase
+        tally = VoteTally(dict.fromkeys(votes.values()), favored=ai_player)
+        for voter, target in votes.items():
+            tally.vote(voter, target)
+        result.most_voted = tally.leader
+        result.detected = result.most_voted == ai_player
+    return result
+
+
+def replay_file(path: str, process_fn: Optional[ProcessFn] = None, vote_fn: VoteFn = recorded_votes,
+                quiet: bool = True, **kwargs) -> ReplayResult:
+    """Replay one transcript file in a fresh event loop. Runs in a worker process."""
+    try:
+        transcript = load_transcript(path)
+        if not quiet:
+            return asyncio.run(replay_transcript(transcript, path, process_fn, vote_fn, **kwargs))
+        # AIClient logs every tick, which would dominate a max-speed replay
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            return asyncio.run(replay_transcript(transcript, path, process_fn, vote_fn, **kwargs))
+    except Exception as e:
+        return ReplayResult(transcript=path, error=str(e))
+
+
+def replay_many(paths: List[str], process_fn: Optional[ProcessFn] = None, vote_fn: VoteFn = recorded_votes,
+                workers: Optional[int] = None, **kwargs) -> List[ReplayResult]:
+    """
+    Replay transcripts in parallel across processes.
+
+    process_fn and vote_fn must be picklable (module-level functions).
+    """
+    run = partial(replay_file, process_fn=process_fn, vote_fn=vote_fn, **kwargs)
+    if workers == 1:
+        return list(map(run, paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, paths))
+
+
+def summarize(results: List[ReplayResult]) -> dict:
+    ok = [r for r in results if r.error is None]
+    reactions = [t for r in ok for t in r.reaction_times]
+    voted = [r for r in ok if r.detected is not None]
+    decisions = sum(r.decisions for r in ok)
+    return {
+        "replays": len(results),
+        "errors": len(results) - len(ok),
+        "decisions": decisions,
+        "ai_messages": sum(r.ai_messages for r in ok),
+        "speak_rate": sum(r.ai_messages for r in ok) / decisions if decisions else 0.0,
+        "ai_message_share": (sum(r.ai_messages for r in ok)
+                             / max(1, sum(r.ai_messages + r.human_messages for r in ok))),
+        "reaction_time_median_s": statistics.median(reactions) if reactions else None,
+        "reaction_time_mean_s": statistics.mean(reactions) if reactions else None,
+        "detection_rate": sum(r.detected for r in voted) / len(voted) if voted else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded lobbies through the AI client")
+    parser.add_argument("transcripts", nargs="+")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--silent-baseline", action="store_true",
+                        help="use a process_fn that never calls the LLM")
+    parser.add_argument("--prompt-layout", default=PROMPT_LAYOUT, choices=PROMPT_LAYOUTS)
+    parser.add_argument("--decision-latency", type=float, default=DECISION_LATENCY_S,
+                        help="virtual seconds charged per AI decision")
+    parser.add_argument("--per-replay", action="store_true", help="print every replay's result")
+    args = parser.parse_args()
+
+    process_fn = always_silent if args.silent_baseline else None
+    results = replay_many(args.transcripts, process_fn=process_fn, workers=args.workers,
+                          prompt_layout=args.prompt_layout, decision_latency_s=args.decision_latency)
+    if args.per_replay:
+        for r in results:
+            print(json.dumps({**asdict(r), "speak_rate": r.speak_rate}))
+    print(json.dumps(summarize(results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
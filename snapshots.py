@@ -0,0 +1,104 @@
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+
+import json
+import sqlite3
+import time
+import zlib
+
+# How often in-memory lobbies are written to disk (seconds)
+SNAPSHOT_INTERVAL_S = 5.0
+# Restored lobbies nobody reconnects to within this window are dropped (seconds)
+RESTORE_GRACE_S = 120.0
+# Lobbies collected per slice, the caller yields to the event loop between slices
+COLLECT_CHUNK = 100
+
+
+def encode_state(state: dict) -> bytes:
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode_state(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob))
+
+
+class LobbySnapshotStore:
+    """
+    Per-lobby snapshots in a SQLite table, one zlib-compressed JSON blob per lobby.
+
+    Snapshots are incremental: the caller supplies a cheap change token per
+    lobby (e.g. history lengths), and only lobbies whose token moved since the
+    last snapshot are serialized and rewritten. Rows of lobbies that are gone
+    are deleted.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS LobbySnapshots("
+            "lobby_id TEXT PRIMARY KEY, "
+            "saved_at REAL, "
+            "state BLOB"
+            ");"
+        )
+        self._tokens: Dict[str, Hashable] = {}
+
+    def collect(self, items: Iterable[Tuple[str, Any]], token_fn: Callable[[Any], Hashable],
+                state_fn: Callable[[Any], dict]) -> List[Tuple[str, Hashable, dict]]:
+        """
+        Gather the (lobby_id, lobby) items that changed since the last snapshot.
+        Call from the thread that owns the lobbies; the result can be written from another.
+        Large lobby sets can be collected a slice at a time.
+        """
+        changed = []
+        for lobby_id, lobby in items:
+            token = token_fn(lobby)
+            if self._tokens.get(lobby_id) != token:
+                changed.append((lobby_id, token, state_fn(lobby)))
+        return changed
+
+    def removed(self, lobbies: Dict[str, Any]) -> List[str]:
+        """Ids stored by an earlier snapshot that are no longer in lobbies."""
+        return [lobby_id for lobby_id in self._tokens if lobby_id not in lobbies]
+
+    def write(self, changed: List[Tuple[str, Hashable, dict]], removed: List[str]) -> int:
+        """
+        Persist the output of collect() in one transaction. Returns the number of rows written.
+        changed is emptied as it is encoded.
+        """
+        if not changed and not removed:
+            return 0
+        now = time.time()
+        rows = []
+        tokens = []
+        # Free each state once it is encoded. Dropping them all at the end is one
+        # long deallocation that holds the GIL, and so stalls the event loop.
+        changed.reverse()
+        while changed:
+            lobby_id, token, state = changed.pop()
+            rows.append((lobby_id, now, encode_state(state)))
+            tokens.append((lobby_id, token))
+        del state
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO LobbySnapshots(lobby_id, saved_at, state) VALUES (?, ?, ?)", rows
+            )
+            self.conn.executemany("DELETE FROM LobbySnapshots WHERE lobby_id = ?", [(i,) for i in removed])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        for lobby_id, token in tokens:
+            self._tokens[lobby_id] = token
+        for lobby_id in removed:
+            self._tokens.pop(lobby_id, None)
+        return len(rows)
+
+    def load(self) -> Dict[str, dict]:
+        """Read every stored lobby state."""
+        rows = self.conn.execute("SELECT lobby_id, state FROM LobbySnapshots").fetchall()
+        return {lobby_id: decode_state(blob) for lobby_id, blob in rows}
+
+    def mark_clean(self, lobby_id: str, token: Hashable):
+        """Record that lobby_id's stored state matches token, e.g. right after a restore."""
+        self._tokens[lobby_id] = token
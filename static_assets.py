@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import Response
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is served without it
+    brotli = None
+
+# Clients may cache but must revalidate, which costs a 304 once the ETag matches
+CACHE_CONTROL = "public, no-cache"
+# Bodies smaller than this are not worth compressing (bytes)
+MIN_COMPRESS_BYTES = 256
+# Distinct Accept-Encoding headers whose chosen variant is remembered
+MAX_CACHED_ENCODINGS = 64
+
+
+class PrecomputedResponse(Response):
+    """A Response whose body and headers were built ahead of time."""
+
+    def __init__(self, body: bytes, raw_headers: List[Tuple[bytes, bytes]], status_code: int = 200):
+        self.status_code = status_code
+        self.body = body
+        # copy the list, not the body, in case middleware edits headers
+        self.raw_headers = list(raw_headers)
+        self.background = None
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Parse Accept-Encoding into {coding: q}."""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class StaticAsset:
+    """
+    One static file held in memory with its compressed variants.
+
+    The variants, their strong ETags and their response headers are built
+    once, so serving a request only picks a variant and checks
+    If-None-Match. Each content coding gets its own ETag, since the bytes
+    differ.
+    """
+
+    def __init__(self, body: bytes, media_type: str):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # coding -> (body, full headers, headers kept on a 304)
+        self.variants: Dict[str, Tuple[bytes, List[Tuple[bytes, bytes]], List[Tuple[bytes, bytes]]]] = {}
+        self.etags: Dict[str, str] = {}
+        # browsers send a handful of distinct Accept-Encoding values, so parse each once
+        self._selected: Dict[str, str] = {}
+        candidates = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            # mtime=0 keeps the gzip bytes, and so the ETag, stable across restarts
+            candidates["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body, quality=11)
+        for coding, data in candidates.items():
+            if coding != "identity" and len(data) >= len(body):
+                continue
+            etag = f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"'
+            validators = [
+                (b"etag", etag.encode("latin-1")),
+                (b"cache-control", CACHE_CONTROL.encode("latin-1")),
+                (b"vary", b"accept-encoding"),
+            ]
+            headers = [
+                (b"content-length", str(len(data)).encode("latin-1")),
+                (b"content-type", media_type.encode("latin-1")),
+            ] + validators
+            if coding != "identity":
+                headers.append((b"content-encoding", coding.encode("latin-1")))
+            self.variants[coding] = (data, headers, validators)
+            self.etags[coding] = etag
+
+    @classmethod
+    def from_file(cls, path: str, media_type: str, fallback: Optional[bytes] = None) -> "StaticAsset":
+        try:
+            with open(path, "rb") as file:
+                return cls(file.read(), media_type)
+        except FileNotFoundError:
+            if fallback is None:
+                raise
+            print(f"Warning: {path} not found, using fallback")
+            return cls(fallback, media_type)
+
+    def select(self, accept_encoding: str) -> str:
+        """Pick the smallest variant the client accepts."""
+        coding = self._selected.get(accept_encoding)
+        if coding is not None:
+            return coding
+        coding = "identity"
+        accepted = accepted_encodings(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        for candidate in ("br", "gzip"):
+            if candidate in self.variants and accepted.get(candidate, wildcard) > 0:
+                coding = candidate
+                break
+        if len(self._selected) < MAX_CACHED_ENCODINGS:
+            self._selected[accept_encoding] = coding
+        return coding
+
+    def response(self, accept_encoding: str = "", if_none_match: str = "") -> Response:
+        coding = self.select(accept_encoding)
+        body, headers, validators = self.variants[coding]
+        if if_none_match and _etag_matches(if_none_match, self.etags[coding]):
+            return PrecomputedResponse(b"", validators, status_code=304)
+        return PrecomputedResponse(body, headers)
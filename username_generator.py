@@ -1,43 +1,131 @@
+import math
 import random
+import threading
+
+ADJECTIVES = (
+    "fast","lazy","happy","angry","silent",
+    "brave","clever","shy","curious","loyal",
+    "wild","calm","fierce","gentle","bold",
+    "mighty","tiny","jolly","wise","grumpy",
+    "quick","sneaky","noisy","bright","dark",
+    "sleepy","hungry","proud","crazy","chill",
+    "stormy","sunny","frosty","dusty","rusty",
+    "sharp","smooth","rough","strange","funny",
+    "glorious","ancient","modern","epic","simple",
+    "rare","common","hot","cold","warm"
+)
+
+NOUNS = (
+    "tiger","dragon","leaf","river","star",
+    "wolf","lion","bear","eagle","hawk",
+    "shark","whale","dolphin","octopus","crab",
+    "tree","rock","mountain","cloud","storm",
+    "sun","moon","planet","galaxy","comet",
+    "flame","shadow","ghost","spirit","demon",
+    "angel","wizard","knight","samurai","ninja",
+    "pirate","robot","cyborg","alien","giant",
+    "phoenix","griffin","unicorn","serpent","kraken",
+    "fox","owl","bat","deer","panther",
+    # AI-related
+    "neuron","matrix","tensor","model","prompt",
+    "agent","bot","server","quantum","algorithm"
+)
+
+N_NUMBERS = 1000
+N_NAMES = len(ADJECTIVES) * len(NOUNS) * N_NUMBERS
+
+_ADJECTIVE_INDEX = {adj: i for i, adj in enumerate(ADJECTIVES)}
+_NOUN_INDEX = {noun: i for i, noun in enumerate(NOUNS)}
+
+
+def username_from_index(index: int) -> str:
+    """Map an index in [0, N_NAMES) to its username"""
+    rest, num = divmod(index, N_NUMBERS)
+    adj, noun = divmod(rest, len(NOUNS))
+    return f"{ADJECTIVES[adj]}-{NOUNS[noun]}{num}"
+
+
+def index_from_username(username: str) -> int:
+    """Inverse of username_from_index, -1 if the name is not from this space"""
+    adj, _, rest = username.partition("-")
+    noun = rest.rstrip("0123456789")
+    digits = rest[len(noun):]
+    if adj not in _ADJECTIVE_INDEX or noun not in _NOUN_INDEX:
+        return -1
+    if not digits or str(int(digits)) != digits or int(digits) >= N_NUMBERS:
+        return -1
+    return (_ADJECTIVE_INDEX[adj] * len(NOUNS) + _NOUN_INDEX[noun]) * N_NUMBERS + int(digits)
+
 
 def generate_username():
     """Generate a random username in the format: adjective-noun123"""
-    
-    
-    adjectives = [
-        "fast","lazy","happy","angry","silent",
-        "brave","clever","shy","curious","loyal",
-        "wild","calm","fierce","gentle","bold",
-        "mighty","tiny","jolly","wise","grumpy",
-        "quick","sneaky","noisy","bright","dark",
-        "sleepy","hungry","proud","crazy","chill",
-        "stormy","sunny","frosty","dusty","rusty",
-        "sharp","smooth","rough","strange","funny",
-        "glorious","ancient","modern","epic","simple",
-        "rare","common","hot","cold","warm"
-    ]
-    
-    nouns = [
-        "tiger","dragon","leaf","river","star",
-        "wolf","lion","bear","eagle","hawk",
-        "shark","whale","dolphin","octopus","crab",
-        "tree","rock","mountain","cloud","storm",
-        "sun","moon","planet","galaxy","comet",
-        "flame","shadow","ghost","spirit","demon",
-        "angel","wizard","knight","samurai","ninja",
-        "pirate","robot","cyborg","alien","giant",
-        "phoenix","griffin","unicorn","serpent","kraken",
-        "fox","owl","bat","deer","panther",
-        # AI-related
-        "neuron","matrix","tensor","model","prompt",
-        "agent","bot","server","quantum","algorithm"
-    ]
-    
-    adj = random.choice(adjectives)
-    noun = random.choice(nouns)
-    num = random.randint(0, 999)
-    
-    return f"{adj}-{noun}{num}"
+    return username_from_index(random.randrange(N_NAMES))
+
+
+class UsernameAllocator:
+    """
+    Hands out globally unique usernames.
+
+    Names are visited in a random-looking but bijective order
+    (index = a * counter + b mod N_NAMES, with a coprime to N_NAMES) and
+    taken names are tracked in a bitmap, so allocate and release are O(1)
+    while most of the space is free.
+    """
+
+    def __init__(self, seed=None):
+        rng = random.Random(seed)
+        self._a = rng.randrange(1, N_NAMES)
+        while math.gcd(self._a, N_NAMES) != 1:
+            self._a = rng.randrange(1, N_NAMES)
+        self._b = rng.randrange(N_NAMES)
+        self._counter = 0
+        self._taken = bytearray((N_NAMES + 7) // 8)
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def allocate(self) -> str:
+        with self._lock:
+            if self.allocated >= N_NAMES:
+                raise RuntimeError("All usernames are taken")
+            while True:
+                index = (self._a * self._counter + self._b) % N_NAMES
+                self._counter = (self._counter + 1) % N_NAMES
+                byte, bit = divmod(index, 8)
+                if not self._taken[byte] & (1 << bit):
+                    self._taken[byte] |= 1 << bit
+                    self.allocated += 1
+                    return username_from_index(index)
+
+    def reserve(self, username: str) -> bool:
+        """Mark a known name as taken, e.g. after a restore. Returns False if it already was."""
+        index = index_from_username(username)
+        if index < 0:
+            return False
+        byte, bit = divmod(index, 8)
+        with self._lock:
+            if self._taken[byte] & (1 << bit):
+                return False
+            self._taken[byte] |= 1 << bit
+            self.allocated += 1
+            return True
+
+    def release(self, username: str):
+        """Return a name to the pool. Unknown or free names are ignored."""
+        index = index_from_username(username)
+        if index < 0:
+            return
+        byte, bit = divmod(index, 8)
+        with self._lock:
+            if self._taken[byte] & (1 << bit):
+                self._taken[byte] &= ~(1 << bit)
+                self.allocated -= 1
+
+    def __contains__(self, username: str) -> bool:
+        index = index_from_username(username)
+        if index < 0:
+            return False
+        byte, bit = divmod(index, 8)
+        return bool(self._taken[byte] & (1 << bit))
 
 
 # Example usage
@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, Optional
+
+
+class VoteTally:
+    """
+    Vote counts for one voting phase, updated in O(1) per vote.
+
+    Players are grouped by vote count, each group in the order its players
+    reached that count, so the top count, the leader and whether the lead
+    is tied are read without scanning. The leader follows the game's rule:
+    most votes wins, the favored player (the AI) wins ties, otherwise the
+    player who reached the top count first.
+    """
+
+    def __init__(self, candidates: Iterable[str], favored: Optional[str] = None):
+        """
+        Args:
+            candidates: Players that can receive votes, in tie-break order while nobody has votes
+            favored: Player that wins any tie it is part of
+        """
+        self.favored = favored
+        self.counts: Dict[str, int] = {c: 0 for c in candidates}
+        self.ballots: Dict[str, str] = {}  # voter -> target
+        # vote count -> players with that count (dict as an insertion-ordered set)
+        self._by_count: Dict[int, Dict[str, None]] = {0: dict.fromkeys(self.counts)} if self.counts else {}
+        self.top = 0
+        # players whose count changed since the last take_changes()
+        self._changed: Dict[str, None] = {}
+
+    def vote(self, voter: str, target: str) -> bool:
+        """Record or move voter's ballot. Returns False if nothing changed."""
+        if target not in self.counts:
+            return False
+        old = self.ballots.get(voter)
+        if old == target:
+            return False
+        self.ballots[voter] = target
+        if old is not None:
+            self._move(old, -1)
+        self._move(target, 1)
+        return True
+
+    def _move(self, player: str, step: int):
+        count = self.counts[player]
+        group = self._by_count[count]
+        del group[player]
+        if not group:
+            del self._by_count[count]
+        count += step
+        self.counts[player] = count
+        self._by_count.setdefault(count, {})[player] = None
+        self._changed[player] = None
+        if count > self.top:
+            self.top = count
+        elif self.top not in self._by_count:
+            # counts move by one, so the group just below is never empty
+            self.top -= 1
+
+    @property
+    def leader(self) -> Optional[str]:
+        if not self.counts:
+            return None
+        top = self._by_count[self.top]
+        if self.favored in top:
+            return self.favored
+        return next(iter(top))
+
+    @property
+    def tied(self) -> bool:
+        return bool(self.counts) and len(self._by_count[self.top]) > 1
+
+    def take_changes(self) -> Dict[str, int]:
+        """Counts changed since the last call, for delta updates."""
+        changes = {player: self.counts[player] for player in self._changed}
+        self._changed.clear()
+        return changes